@@ -0,0 +1,159 @@
+"""
+End-to-end restock benchmark, run against fumo_mock_shop.
+Measures the time from the restock to its detection, to the first item in the cart and to the placed order, along with the request counts.
+
+    python fumo_benchmark.py --runs 5 --items 3 --api-errors 503:0.3,429:0.05
+    python fumo_benchmark.py --browser  # also goes through the checkout, requires chromedriver.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from fumo_mock_shop import MockShop, start_mock_shop, mock_url_overrides, parse_schedule, parse_rates, CART_TYPE_CLOSED, CART_TYPE_SOON, CART_TYPE_ON_SALE_PRE
+
+
+def mock_items(count):
+    """
+    :return: Item data in the same format as fumo_data.json, for items the mock shop will happily sell.
+    """
+    return [{"scode": f"MOCK-{i:08d}", "desc": f"Mock item {i}", "max_cartin_count": 3, "amount": 1} for i in range(count)]
+
+
+def run_api(shop: MockShop, items_data) -> dict:
+    """
+    A single run of the API-only part of the flow: detection followed by adding everything to the cart.
+    :return: time() of the first detection under "detected_at", None if the monitor stopped before detecting anything (e.g. on a 429).
+    """
+    # only imported now, so that the URL overrides are already in place.
+    from fumo_cart import CartEngine
+    from fumo_constants import headers, base_request_data, API_CART_URL, PREWARM_CONNECTIONS, PIPELINED_CART
+    from fumo_config import generate_item_jsons_pre_order, generate_item_jsons_check_info
+    from fumo_governor import RateGovernor
+    from fumo_monitor import StockMonitor
+    from fumo_tokens import SessionTokens
+    from fumo_warmup import ConnectionWarmer, build_api_session
+
+    session = build_api_session()
+    session.headers.update(headers)
+    tokens = SessionTokens("mock-ransu", "mock-mcode")
+    governor = RateGovernor()
+    engine = CartEngine(session, tokens, governor)
+    if PREWARM_CONNECTIONS:
+        ConnectionWarmer(session, API_CART_URL, governor=governor).warm_up()
+    item_jsons = generate_item_jsons_pre_order(base_request_data, items_data)
+
+    shop.reset()
+    if PIPELINED_CART:  # same handoff as FumoCarter.detect_and_add_items
+        batch = engine.start_batch(item_jsons)
+        by_scode = {item['scode']: item for item in item_jsons}
+        first_detection = []
+
+        def on_detect(item_check_info, vals, perf_detected_at):
+            first_detection.append(time.time())
+            engine.submit(batch, by_scode.pop(item_check_info['gcode']), detected_at=perf_detected_at)
+
+        asyncio.run(StockMonitor(headers, {}, governor).wait_for_cart_type(generate_item_jsons_check_info(items_data), tokens, on_detect=on_detect, stop=batch.cancelled))
+        detected_at = first_detection[0] if first_detection else None
+        for item in by_scode.values():  # never detected, the monitor stopped early
+            engine.submit(batch, item)
+        batch.done.wait()
+    else:
+        found = asyncio.run(StockMonitor(headers, {}, governor).wait_for_cart_type(generate_item_jsons_check_info(items_data), tokens))
+        detected_at = time.time() if found is not None else None
+        engine.add_items(item_jsons)
+    engine.stop()
+    return {"detected_at": detected_at}
+
+
+def run_browser(shop: MockShop, carter, items_data) -> dict:
+    """
+    A single run of the complete flow, checkout included, with an already logged in FumoCarter.
+    :return: Same as run_api.
+    """
+    from fumo_constants import base_request_data
+    from fumo_config import generate_item_jsons_pre_order, generate_item_jsons_check_info
+
+    item_jsons = generate_item_jsons_pre_order(base_request_data, items_data)
+    shop.reset()
+    found = carter.wait_for_item_in_stock(generate_item_jsons_check_info(items_data))
+    detected_at = time.time() if found is not None else None
+    carter.add_items_to_cart_api_mt(item_jsons)
+    carter.checkout()
+    return {"detected_at": detected_at}
+
+
+def summarize(runs):
+    """
+    Prints the median, min and max of every measurement over all the runs.
+    """
+    print(f"\n{'measurement':<28}{'median':>10}{'min':>10}{'max':>10}")
+    for key in runs[0].keys():
+        values = [run[key] for run in runs if run[key] is not None]
+        if not values:
+            print(f"{key:<28}{'-':>10}{'-':>10}{'-':>10}")
+            continue
+        print(f"{key:<28}{statistics.median(values):>10.3f}{min(values):>10.3f}{max(values):>10.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Restock benchmark against the mock shop.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--items", type=int, default=3, help="Amount of watched items")
+    parser.add_argument("--restock-after", type=float, default=3, help="Seconds from the start of a run until the restock")
+    parser.add_argument("--soon-for", type=float, default=0, help="Seconds the items say \"soon\" before the restock, 0 goes from closed to on sale directly")
+    parser.add_argument("--schedule", type=parse_schedule, default=None, help='Full timeline instead of --restock-after, "seconds:cart_type,..."')
+    parser.add_argument("--api-errors", type=parse_rates, default={}, help='"code:rate,..." e.g. "503:0.2,429:0.05,400:0.01"')
+    parser.add_argument("--page-overload", type=float, default=0.0)
+    parser.add_argument("--page-cart-error", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--browser", action="store_true", help="Run the whole flow including the checkout")
+    parser.add_argument("--json", help="Also write the raw results of every run to this file")
+    args = parser.parse_args()
+
+    schedule = args.schedule or ([(0, CART_TYPE_CLOSED)] + ([(max(0.0, args.restock_after - args.soon_for), CART_TYPE_SOON)] if args.soon_for else [])
+                                 + [(args.restock_after, CART_TYPE_ON_SALE_PRE)])
+    shop = MockShop(schedule, args.api_errors, args.page_overload, args.page_cart_error, args.retry_after, args.seed)
+    server = start_mock_shop(shop)
+    os.environ.update(mock_url_overrides(f"http://127.0.0.1:{server.server_address[1]}"))
+
+    items_data = mock_items(args.items)
+    carter = None
+    if args.browser:
+        import fumo_carter
+        from fumo_config import current_config, set_config
+
+        set_config(current_config()._replace(finish_order=True))  # it's the mock shop, we always want to get to the end.
+        carter = fumo_carter.FumoCarter(persist_session=False)
+        carter.account_login()
+        carter.get_session_tokens()
+        carter.define_requests_session()
+
+    runs = []
+    for run in range(args.runs):
+        print(f"\n# Run {run + 1}/{args.runs}")
+        measured = run_browser(shop, carter, items_data) if args.browser else run_api(shop, items_data)
+        stats = shop.stats()
+        requests_sent = {endpoint: sum(per_code.values()) for endpoint, per_code in stats["requests"].items()}
+        runs.append({
+            # the monitor can stop early on a 429, the restock was never seen then (nor maybe even reached). its exit time is no detection.
+            "detection_s": None if measured["detected_at"] is None or stats["restocked_at"] is None else measured["detected_at"] - stats["restocked_at"],
+            "cart_add_s": stats["first_cart_add_s"],
+            "order_placed_s": stats["order_placed_s"],
+            "item_requests": requests_sent.get("item", 0),
+            "cart_requests": requests_sent.get("cart", 0),
+            "checkout_pages": requests_sent.get("checkout", 0),
+            "throttled_responses": sum(per_code.get(429, 0) + per_code.get(503, 0) for per_code in stats["requests"].values()),
+        })
+
+    summarize(runs)
+    stopped_early = sum(run["detection_s"] is None for run in runs)
+    if stopped_early:
+        print(f"The monitor stopped before detecting the restock in {stopped_early}/{len(runs)} runs, they're left out of detection_s.")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "json"}, "runs": runs}, f, indent=2)
+    server.shutdown()
@@ -0,0 +1,328 @@
+import threading
+from queue import Queue
+from time import monotonic, perf_counter
+from typing import Dict, List, Optional
+
+import requests
+
+from fumo_config import current_config
+from fumo_constants import *
+from fumo_governor import RateGovernor
+from fumo_metrics import metrics
+from fumo_tokens import SessionTokens
+
+
+def fetch_cart(session: requests.Session, tokens: SessionTokens, governor: Optional[RateGovernor] = None) -> Optional[Dict[str, int]]:
+    """
+    Reads the cart through the API. The response is expected to look like {"items": [{"scode": ..., "amount": ...}, ...]}
+    :param governor: Rate limit to go through, if any.
+    :return: scode -> amount of every item in the cart, None if the cart couldn't be read.
+    """
+    if governor is not None:
+        governor.acquire()
+    try:
+        response = session.request("GET", API_CART_URL, headers=headers, params=tokens.apply({"lang": "eng"}), timeout=API_REQUEST_TIMEOUT_S)
+    except requests.RequestException as e:
+        print(f"Reading the cart failed: {e!r}")
+        return None
+    tokens.refresh_from_cookies(response.cookies)
+    if governor is not None:
+        governor.on_response(response.status_code, response.headers.get("Retry-After"))
+    if response.status_code != STATUS_SUCCESS:
+        return None
+    try:
+        return {item['scode']: item.get('amount', 1) for item in response.json()['items']}
+    except (ValueError, KeyError, TypeError):
+        print("Unexpected cart format")
+        return None
+
+
+class CartState:
+    """
+    What the cart actually holds according to the API, against the quantities we're after.
+    Decides what still has to be added, so that nothing is sent twice and nothing is forgotten, whatever happened to the requests on the way.
+    """
+
+    def __init__(self, session: requests.Session, tokens: SessionTokens, items_jsons: List[dict], governor: Optional[RateGovernor] = None,
+                 max_age_s=CART_STATE_MAX_AGE_S):
+        """
+        :param items_jsons: Request payloads as generated by generate_item_jsons_pre_order, their amounts are the targets.
+        :param max_age_s: Cached cart contents older than this are read again.
+        """
+        self.session = session
+        self.tokens = tokens
+        self.governor = governor
+        self.max_age_s = max_age_s
+        self.items = {}
+        self.targets = {}
+        self.ordered = {}  # amounts which already went through a checkout
+        self._contents: Optional[Dict[str, int]] = None
+        self._read_at = 0.0
+        self.retarget(items_jsons)
+
+    def retarget(self, items_jsons: List[dict]):
+        """
+        Switches to a new list of items, e.g. after a config reload. What was already ordered still counts against the new targets.
+        :param items_jsons: Request payloads as generated by generate_item_jsons_pre_order, their amounts are the targets.
+        """
+        self.items = {item['scode']: item for item in items_jsons}
+        self.targets = {item['scode']: item['amount'] for item in items_jsons}
+        for scode in self.targets:
+            self.ordered.setdefault(scode, 0)
+
+    def contents(self, refresh=False) -> Optional[Dict[str, int]]:
+        """
+        :param refresh: Read the cart again even if the cached contents are recent enough.
+        :return: scode -> amount in the cart. When the cart can't be read, the last known contents, None if there are none.
+        """
+        if refresh or self._contents is None or monotonic() - self._read_at > self.max_age_s:
+            contents = fetch_cart(self.session, self.tokens, self.governor)
+            if contents is not None:
+                self._contents, self._read_at = contents, monotonic()
+        return None if self._contents is None else dict(self._contents)
+
+    def targeted_contents(self, refresh=False) -> Dict[str, int]:
+        """
+        Same as contents, limited to the items we're after. Whatever else might be in the cart isn't our business.
+        """
+        return {scode: amount for scode, amount in (self.contents(refresh) or {}).items() if scode in self.targets and amount > 0}
+
+    def record_adds(self, results: Dict[str, Optional[requests.Response]], sent: List[dict]):
+        """
+        Updates the cached contents with the successful cart additions, until the next read tells us better.
+        :param results: Result table of a cart batch
+        :param sent: The payloads of the batch, for the amounts.
+        """
+        contents = self._contents or {}
+        for item in sent:
+            response = results.get(item['scode'])
+            if response is not None and response.status_code == STATUS_SUCCESS:
+                contents[item['scode']] = contents.get(item['scode'], 0) + item['amount']
+        self._contents = contents
+
+    def missing(self) -> List[dict]:
+        """
+        :return: Payloads for every item short of its target, with the amount set to what's missing.
+        """
+        contents = self.contents() or {}
+        missing = []
+        for scode, target in self.targets.items():
+            amount = target - self.ordered[scode] - contents.get(scode, 0)
+            if amount > 0:
+                missing.append({**self.items[scode], 'amount': amount})
+        return missing
+
+    def record_checkout(self, before: Dict[str, int]) -> Optional[Dict[str, int]]:
+        """
+        Call after a checkout. Whatever left the cart in the meantime counts as ordered.
+        :param before: The cart contents the checkout started with.
+        :return: What is still in the cart out of before, empty if all of it was ordered. None if the cart couldn't be read, in which case
+                 nothing is known about the checkout and nothing is counted.
+        """
+        after = None
+        for _ in range(CART_READ_ATTEMPTS):  # not contents(), whose fallback is the cart from before the checkout
+            after = fetch_cart(self.session, self.tokens, self.governor)
+            if after is not None:
+                break
+        if after is None:
+            self._read_at = 0.0  # the cached contents predate the checkout, read them again at the first chance
+            print("Couldn't read the cart after the checkout, whether it went through is unknown.")
+            return None
+        self._contents, self._read_at = after, monotonic()
+        for scode, amount in before.items():
+            gone = amount - after.get(scode, 0)
+            if scode in self.ordered and gone > 0:
+                self.ordered[scode] += gone
+        return {scode: after[scode] for scode in before if after.get(scode, 0) > 0}
+
+
+class CartBatch:
+    """
+    A single round of cart additions. Holds the per-item result table, and the event used to cancel the remaining workers.
+    The payloads are read at send time, and can be swapped while the batch runs (see add, update and remove).
+    """
+
+    def __init__(self, items_jsons: List[dict]):
+        self.results: Dict[str, Optional[requests.Response]] = {item['scode']: None for item in items_jsons}
+        self.items: Dict[str, dict] = {item['scode']: item for item in items_jsons}  # never modified, replaced as a whole
+        self.cancelled = threading.Event()  # set on the first stop condition, interrupts every worker waiting on it.
+        self.done = threading.Event()  # set once every item of the batch has a result.
+        self._pending = len(items_jsons)
+        self._lock = threading.Lock()
+        if not self._pending:
+            self.cancelled.set()
+            self.done.set()
+
+    def cancel(self):
+        """
+        Stops all the workers of this batch at their next wait.
+        """
+        self.cancelled.set()
+
+    def add(self, item: dict) -> bool:
+        """
+        Adds an item to the running batch. It still has to be submitted, and the batch isn't done until it was.
+        :return: False if the batch is already done.
+        """
+        with self._lock:
+            if self.done.is_set():
+                return False
+            if item['scode'] not in self.results:
+                self.results[item['scode']] = None
+                self._pending += 1
+            self.items = {**self.items, item['scode']: item}
+        return True
+
+    def update(self, item: dict):
+        """
+        Replaces the payload of an item of the batch, its next request sends the new one.
+        """
+        with self._lock:
+            if item['scode'] in self.items:
+                self.items = {**self.items, item['scode']: item}
+
+    def remove(self, scode):
+        """
+        Has the worker of the item stop at its next request. Items which weren't submitted yet still have to be finished by whoever holds them.
+        """
+        with self._lock:
+            self.items = {key: item for key, item in self.items.items() if key != scode}
+
+    def finish(self, scode, response):
+        """
+        Records the final response for an item.
+        """
+        with self._lock:
+            self.results[scode] = response
+            self._pending -= 1
+            if not self._pending:  # nothing left to wait for, this also cuts short any post-success grace period.
+                self.cancelled.set()
+                self.done.set()
+
+
+class CartEngine:
+    """
+    Adds items to the cart through the API, using a pool of worker threads which is started once and lives for the whole run.
+    """
+
+    def __init__(self, session: requests.Session, tokens: SessionTokens, governor: Optional[RateGovernor] = None, workers=CART_WORKERS):
+        """
+        :param session: Requests session used for the API calls
+        :param tokens: Token store, read for every request.
+        :param governor: Rate limit shared with the rest of the API requests, a fresh one by default.
+        :param workers: Amount of worker threads, which is the maximal amount of items added concurrently.
+        """
+        self.session = session
+        self.tokens = tokens
+        self.governor = governor or RateGovernor()
+        self._jobs = Queue()
+        self._threads = [threading.Thread(target=self._worker, name=f"cart-worker-{i}", daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def add_items(self, items_jsons: List[dict]) -> Dict[str, Optional[requests.Response]]:
+        """
+        Attempts to add all the items to the cart, and blocks until every one of them either succeeded or was cancelled.
+        :param items_jsons: Request payloads as generated by generate_item_jsons_pre_order, the session tokens are added to each request.
+        :return: Table of the last response for each scode, None if no request was sent for it.
+        """
+        batch = self.start_batch(items_jsons)
+        for item in items_jsons:
+            self.submit(batch, item)
+        batch.done.wait()
+        return batch.results
+
+    def start_batch(self, items_jsons: List[dict]) -> CartBatch:
+        """
+        Creates a batch whose items get handed to the workers one by one with submit(), e.g. as they get detected in stock.
+        The batch is done once every one of its items was submitted and has a result.
+        """
+        return CartBatch(items_jsons)
+
+    def submit(self, batch: CartBatch, item: dict, detected_at=None):
+        """
+        Hands a single item of the batch to the workers, without waiting for anything. Safe to call from any thread, the event loop included.
+        :param detected_at: perf_counter() time at which the item was detected in stock, the time it took for its first request to go out is recorded.
+        """
+        self._jobs.put((batch, item, detected_at))
+
+    def stop(self):
+        """
+        Shuts down the worker threads.
+        """
+        for _ in self._threads:
+            self._jobs.put(None)
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            batch, item, detected_at = job
+            response = None
+            try:
+                with metrics.timed("cart_add"):
+                    response = self._add_item(batch, item, detected_at)
+            except Exception as e:  # keep the worker alive, a dead one would leave later jobs waiting in the queue forever
+                metrics.count("cart_add.errors")
+                print(f"Ordering {item['scode']} failed: {e!r}")
+                continue
+            finally:  # whatever happens, the batch must not wait on this item forever
+                batch.finish(item['scode'], response)
+            config = current_config()
+            if response is not None and response.status_code == STATUS_SUCCESS and not config.order_all_at_once:
+                # the others keep going until the cart confirms this one is really in there, then we stop them. finishing the batch cuts this short.
+                self._confirm(batch, item['scode'], config.wait_time_after_success)
+                batch.cancel()
+
+    @metrics.timed("ready.cart_confirmed")
+    def _confirm(self, batch: CartBatch, scode, timeout_s):
+        """
+        Waits until the cart API shows the item, the batch is over, or timeout_s went by. Only CART_CONFIRM_READS reads at most,
+        no closer together than the governor's pace: the other workers and the monitor share the same request budget.
+        """
+        deadline = monotonic() + timeout_s
+        for read in range(CART_CONFIRM_READS):
+            if read and batch.cancelled.wait(max(CART_CONFIRM_POLL_S, 1 / self.governor.rate)):
+                return
+            if batch.cancelled.is_set() or monotonic() >= deadline:
+                return
+            contents = fetch_cart(self.session, self.tokens, self.governor)
+            if contents is not None and scode in contents:
+                return
+        batch.cancelled.wait(max(0.0, deadline - monotonic()))  # no confirmation, the others get the rest of the grace period
+
+    def _add_item(self, batch: CartBatch, item, detected_at=None) -> Optional[requests.Response]:
+        """
+        Keeps sending the cart request for a single item until it succeeds, the batch gets cancelled or the item is removed from it.
+        :return: The last response, or None if the batch was cancelled before any response came in.
+        """
+        response = None
+        print(f"Now ordering {item['eparams'][1]}")
+        while True:
+            if not self.governor.acquire(batch.cancelled):  # the governor spreads out the requests of all the workers
+                return response
+            item = batch.items.get(item['scode'])  # the latest payload, in case the config was reloaded
+            if item is None:
+                return response
+            if detected_at is not None:
+                metrics.record("pipeline.detect_to_send", perf_counter() - detected_at)
+                detected_at = None
+            try:
+                with metrics.timed("cart_add.request"):
+                    response = self.session.request("POST", API_CART_URL, headers=headers, json=self.tokens.apply(item), timeout=API_REQUEST_TIMEOUT_S)
+            except requests.RequestException as e:  # dropped connections and timeouts are just another failed attempt
+                metrics.count("cart_add.request_errors")
+                print(f"Request failed for ordering of {item['eparams'][1]}: {e!r}")
+            else:
+                self.tokens.refresh_from_cookies(response.cookies)  # in case they got rotated
+                code = response.status_code
+                self.governor.on_response(code, response.headers.get("Retry-After"))
+                print(f"Status code {code} for ordering of {item['eparams'][1]}")
+                if code == STATUS_SUCCESS:
+                    return response
+            # throttling is the governor's business, this only keeps a single item from retrying back to back.
+            with metrics.timed("sleep.cart_backoff"):
+                cancelled = batch.cancelled.wait(current_config().requestor_wait_ms / 1000)
+            if cancelled:
+                return response
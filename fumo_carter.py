@@ -1,486 +1,707 @@
-import os
-from datetime import datetime
-from multiprocessing import Manager
-from time import sleep
-from typing import Tuple, List
-
-import pandas
-import requests
-from joblib import parallel_backend, Parallel, delayed
-from selenium import webdriver
-from selenium.webdriver import DesiredCapabilities
-from selenium.webdriver.common.by import By
-from selenium.webdriver.remote.webelement import WebElement
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium_stealth import stealth
-from seleniumrequests import Chrome
-
-from fumo_constants import *
-
-
-class FumoCarter:
-    """
-    Class reponsible for the entirety of the ordering process.
-    """
-
-    def __init__(self, persist_session=RELOAD_SESSION):
-        self.driver = get_stealthy_driver(persist_session)
-        wait = WebDriverWait(self.driver, 30)
-        self.wait_until = wait.until  # a shorthand
-        self.order_counter = 0
-        self.session = None
-
-        # and we load up the page to setup cookies, sessions, and whatever else. required for the ability to order.
-        self.driver.get(USER_INFO_URL)
-
-    def account_login(self):
-        """
-        Logs into the user account as defined in the constants.
-        """
-        # Actually, we do need to wait a little...
-        self.wait_until(EC.presence_of_element_located((By.CLASS_NAME, 'btn-submit')))
-
-        # First, we have to log in, in order to retrieve the mcode (and avoid changing the ransu). mcodes seem static though
-        self.submit_login()
-        self.wait_until(EC.presence_of_element_located((By.CLASS_NAME, 'search-box__button')))  # required to ensure the cookies have time to load
-        # TODO wait for cookies to appear instead
-        print("Account succesfully logged in, probably")
-        sleep(1)  # Delay for cookie load?
-
-    def submit_login(self):
-        """
-        Submits login information on the current page.
-        """
-        username = self.driver.find_element(by=By.NAME, value='email')
-        username.send_keys(USERNAME)
-        password = self.driver.find_element(by=By.NAME, value='password')
-        password.send_keys(PASSWORD)
-        form = self.driver.find_element(by=By.CLASS_NAME, value='btn-submit')
-        form.submit()
-
-    def get_session_tokens(self):
-        """
-        Retrieves relevant session tokens from the cookies, and saves it to the base_request_data imported from the constants.
-        """
-        # Grab the ransu and mcode into the json baseline data
-        # todo move base_request_data internally
-        for cookie in self.driver.get_cookies():
-            if cookie["name"] == "ransu":
-                base_request_data["ransu"] = cookie["value"]
-                print(f"Cookie: {cookie}")
-            if cookie["name"] == "mcode":
-                base_request_data["mcode"] = cookie["value"]
-                print(f"Cookie: {cookie}")
-        if base_request_data["mcode"] is None:
-            print("Error! mcode is None")
-        print("")
-
-    def load_cart_page(self):
-        """
-        Loads the cart webpage.
-        """
-        self.driver.get(CART_PAGE_URL)
-        # XPath for page specific item to identify successful loading of the page.
-        self.wait_until(EC.presence_of_element_located((By.XPATH, '//*[@id="__layout"]/div/div[1]/div[2]/div/div/div[1]/section/h2')))
-
-    def define_requests_session(self):
-        """
-        Creates a `requests` session with the correct paramters to query the API.
-        """
-        self.session = requests.Session()
-        self.session.headers.update(headers)
-        for cookie in self.driver.get_cookies():
-            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
-
-    def wait_for_item_in_stock(self, items_jsons_check_availablity):
-        """
-        Loop that will wait until either at least one of the items in the list is in stock.
-        :return:
-        """
-        # In this loop, we'll want to, with a high enough interval, check on the fumos to see if they are in stock.
-        # Can be done multi-thread, can also be done single thread with lower interval.
-        # The moment one is found to be in stock, exit all threads immediately and continue to the next step
-        # we set up the async requests session
-        # the way this works is by requesting the item data, and checking that the cart_type parameter is equal to CART_TYPE_ON_SALE_PRE, CART_TYPE_ON_SALE_NO_PRE, or CART_TYPE_ON_SALE_BACK?
-        run_loop = True
-        while run_loop:
-            for item in items_jsons_check_availablity:
-                sleep(LOOP_WAIT_TIME_MS / 1000)
-                response = self.session.request("GET", API_GET_ITEM_INFO_URL, headers=headers, params={**item, "ransu": base_request_data["ransu"]})
-                code = response.status_code
-                print(f"Response was [{code}]")
-
-                if code == STATUS_SUCCESS:
-                    vals = response.json()["item"]
-
-                    if "cart_type" in vals.keys():
-                        print(datetime.now().strftime("%H:%M:%S"), end=" - ")
-                        print(f"Checked item has cart_type={vals['cart_type']} and is {vals['gname']}")
-
-                        if vals["cart_type"] == CART_TYPE_ON_SALE_PRE:
-                            run_loop = False
-                            break
-
-                elif code == STATUS_TROTTLED:
-                    if WAIT_FOR_ITEMS_STOP_ON_OVERLOAD:
-                        print("Throttled.. and out.")
-                        run_loop = False
-                        break
-
-                    print("Throttled :(\nWaiting for some time. total wait time is expected to be about 55s-1m")
-                    sleep(1)
-
-        print("Fumo Detected\n")
-
-    def add_items_to_cart_api_mt(self, items_jsons):
-        """
-        Attempts to add all the items in the list to the cart. Only items that have been successfully added will be removed from the list.
-        This is the multithreaded version
-        """
-        # First, let's create a variable which can be shared between the threads
-        manager = Manager()
-        var_flag = manager.list()  # we want to use this to signal that it is time to exit. we use a list, and append to it every fumo which is finished. we exit whenever the flag isn't empty anymore.
-
-        with parallel_backend('threading', n_jobs=10):
-            res = Parallel()(delayed(mt_request_wrapper(self.session, var_flag))("POST", API_CART_URL, i, headers=headers, json={**item, "ransu": base_request_data["ransu"], "mcode": base_request_data["mcode"]}) for i, item in enumerate(items_jsons))
-        if any(x.status_code != STATUS_SUCCESS for x in res):
-            print("Not all fumos passed. what is currently in the cart has been removed from the list, and will be processed after this order goes through.")
-            for i, item in enumerate(items_jsons):
-                if res[i].status_code == STATUS_SUCCESS:  # if we succeeded, remove from items_jsons
-                    for item_data in items_jsons:
-                        if item_data['scode'] == item['scode']:
-                            print(f"Removed {item['scode']} from item_jsons")
-                            items_jsons.remove(item)
-                            break
-        else:
-            print("All fumo successfully added!\n")
-        if CART_ONLY_MODE:  # testing flag to block off the checkout process.
-            print("You are in cart only mode, script execution stopped.")
-            while True:
-                sleep(1)
-
-    def add_items_to_cart_api_st(self, items_jsons):
-        """
-        Singlethreaded, simpler version of add_items_to_cart_api_mt
-        """
-        for item in items_jsons:
-            response = self.driver.request("POST", API_CART_URL, headers=headers, json={**item, "ransu": base_request_data["ransu"], "mcode": base_request_data["mcode"]})
-            print(f"Responose for {item} is {response} ")
-
-    def checkout(self):
-        """
-        Entirely self-contained handling of the checkout process, assumes that the cort does contain items at this point.
-        Consists of the checkout flow of the target website.
-        """
-
-        def checkout_part_1():
-            """
-            Handles the first part of the checkout process, "rearrangement options".
-            """
-            # TODO add checks to verify that we are indeed in the assumed phase
-            form = self.driver.find_element(by=By.CLASS_NAME, value='btn-submit')
-            form.click()
-
-        def checkout_part_2():
-            """
-            Handles the second part of the checkout process, "Payment & Shipping".
-            """
-
-            def checkout_select_payment_method():
-                """
-                Selects the correct payment method
-                """
-                form = self.driver.find_element(by=By.XPATH, value='//*[@id="__layout"]/div/div/div/div/div[2]/section[2]/div/div[2]/div/label')
-                form.click()
-                # Fill in credit card info
-                try:
-                    self.driver.find_element(by=By.XPATH, value='//*[@id="__layout"]/div/div/div/div/div[2]/section[2]/div/div[2]/div[2]/div[2]/input').send_keys(CARD_NUMBER)
-                    self.driver.find_element(by=By.XPATH, value='//*[@id="__layout"]/div/div/div/div/div[2]/section[2]/div/div[2]/div[2]/div[4]/input').send_keys(CARD_OWNER)
-                    self.driver.find_element(by=By.XPATH, value='//*[@id="__layout"]/div/div/div/div/div[2]/section[2]/div/div[2]/div[2]/div[5]/input').send_keys(SECURITY_CODE)
-                    self.wait_until(EC.presence_of_element_located((By.XPATH, '//*[@id="selectCardType"]')))
-                    Select(self.driver.find_element(by=By.XPATH, value='//*[@id="selectCardType"]')).select_by_index(CARD_TYPE)  # Visa is 0, mastercard is 1
-                    Select(self.driver.find_element(by=By.XPATH, value='//*[@id="__layout"]/div/div/div/div/div[2]/section[2]/div/div[2]/div[2]/div[3]/div[1]/select')).select_by_value(EXP_YEAR)  # The year
-                    Select(self.driver.find_element(by=By.XPATH, value='//*[@id="__layout"]/div/div/div/div/div[2]/section[2]/div/div[2]/div[2]/div[3]/div[2]/select')).select_by_value(EXP_MONTH)  # The month
-                except Exception:  # or don't if it's already in there. There is no other cause for errors besides pre-filled credit card data at this stage, so ignoring it is fine.
-                    pass
-
-            def checkout_select_shipping():
-                """
-                Selects the appropriate shipping method
-                """
-                if DHL:
-                    form = self.driver.find_element(by=By.XPATH, value='//*[@id="__layout"]/div/div/div/div/div[2]/section[3]/div[2]/div[1]/span/label')  # DHL - pain
-                else:
-                    form = self.driver.find_element(by=By.XPATH, value='//*[@id="__layout"]/div/div/div/div/div[2]/section[3]/div[2]/div[2]/span/label')  # Surface parcel - slow
-                form.click()
-
-            checkout_select_shipping()
-
-            # Select payment method and fill relevant information if CC.
-            checkout_select_payment_method()
-
-            # Finally, submit the form.
-            self.driver.find_element(by=By.CLASS_NAME, value='btn-submit').click()
-
-        # speedy checkout
-        self.driver.get(CART_CHECKOUT_URL)
-        while True:
-            res = self.wait_until_err_handling(by=By.CLASS_NAME, value='btn-submit')  # Wait for the login page to load, or an error to be displayed
-            if not res[0]:  # if it returns false, restart the loop
-                continue
-            self.submit_login()
-
-            # Wait for the "Return" button in the 1st step of the checkout process to show up, indicating the loading of the relevant UI chunk is complete.
-            res = self.wait_until_err_handling(by=By.XPATH, value="//button[text()='Return']")
-            if not res[0]:  # if it returns false, restart the loop
-                continue
-            checkout_part_1()
-
-            # we now assume this is the second phase, and move onto the
-            # # # CREDIT CARD SECTION # # #
-            # but we still check for errors, and in case of errors get booted back to start.
-            res = self.wait_until_err_handling(by=By.CLASS_NAME, value="form-radio")  # we wait until the page loads by checking for radio buttons, which are only included in the second part of the checkout iirc
-            if not res[0]:  # if it returns false, this means there was an error, so restart the loop
-                continue
-            checkout_part_2()
-
-            # Then, we wait until there exists a button in the exact right place which indicates phase 3, before finishing up the order.
-            res = self.wait_until_err_handling(by=By.XPATH, value='//*[@id="__layout"]/div/div/div/div/div[2]/section/div[3]/form/button')
-            if not res[0]:  # if it returns false, this means there was an error, so restart the loop
-                continue
-
-            if FINISH_ORDER:
-                self.driver.find_element(by=By.CLASS_NAME, value='btn-submit').click()  # Place order!
-                sleep(5)  # we need a better wait.
-                self.order_counter += 1
-                self.driver.save_screenshot(f"proof_of_order_{self.order_counter}.png")
-            break
-
-    # Various helper methods and tools. could be extracted.
-    def poll_api_for_availability(self):
-        """
-        Polls the website API and logs the response status to monitor availability and reliability.
-        Loops indefinitely.
-        """
-        results = []
-        item = generate_item_jsons_check_info(items_test_data)[0]
-        self.define_requests_session()  # define the requests session
-        counter = 0
-        while True:
-            response = self.session.request("GET", API_GET_ITEM_INFO_URL, headers=headers, params={**item, "ransu": base_request_data["ransu"]})
-            c_time = datetime.now().strftime("%H:%M:%S")
-            code = response.status_code
-            print(f"Response at {c_time} was [{code}]")
-            if code == STATUS_SUCCESS:
-                sleep(LOOP_WAIT_TIME_MS / 1000)
-            elif code == STATUS_TOO_MUCH_TRAFFIC:
-                print("too much traffic, we try again really fast.")
-                sleep(0.1)
-            elif code == STATUS_TROTTLED:
-                print("Throttled, we try again in a bit.")
-                sleep(5)
-            results.append({"time": c_time, "response_code": code})
-            counter += 1
-            if counter % LOG_TO_FILE_FREQUENCY == 0:
-                pandas.DataFrame(results, columns=["time", "response_code"]).to_csv("requests_results.csv")
-
-    # returns true if there were no errors and execution can continue normally, false if there was a problem and the loop should restart. also returns the webelem
-    # calls wait_until_error with the given params
-    def wait_until_err_handling(self, **params) -> Tuple[bool, WebElement]:
-        """
-        A wrapper around wait_until_error_or_cond(ExpectedCondition), which detects the occurence of errors.
-        Appropriately handles the different errors that can occur.
-        :return (Boolean to indicate the error status, WebElement being waited on)
-        """
-        res = self.wait_until_error_or_cond(EC.presence_of_element_located((params["by"], params["value"])))
-        retval = True
-        if res[0] == ERR_NONE:
-            retval = True
-        elif res[0] == ERR_CART:  # if cart error, press it and try again
-            form = self.driver.find_element(by=By.CLASS_NAME, value='btn-back')
-            form.click()  # click the return button, which effectively sends us back to the start, hence
-            retval = False
-        elif res[0] == ERR_OVERLOAD:  # else. start over.
-            self.driver.get(CART_CHECKOUT_URL)
-            retval = False
-        else:
-            pass  # in case of new, more different, exotic errors.
-        return retval, res[1]
-
-    def wait_until_error_or_cond(self, condition) -> Tuple[int, WebElement]:  # thanks to https://stackoverflow.com/a/16464305/12362756
-        """
-        A wrapper around wait_until(ExpectedCondition), which detects the occurence of errors.
-        :param condition: an EC condition to wait for
-        :return (error code, WebElement being waited on)
-        """
-        # Wait until either the condition is fullfilled, or an error pops up
-        self.wait_until(AnyEc(EC.presence_of_element_located((By.CLASS_NAME, 'alert-area__text')),
-                              EC.presence_of_element_located((By.CLASS_NAME, 'item-detail__error-title')),
-                              condition))
-        elem = None
-        try:
-            elem = EC.presence_of_element_located((By.CLASS_NAME, 'alert-area__title'))(self.driver)
-        except Exception:
-            try:
-                elem = EC.presence_of_element_located((By.CLASS_NAME, 'item-detail__error-title'))(self.driver)
-            except Exception:
-                try:
-                    elem = condition(self.driver)
-                except Exception:  # this should probably do something else.
-                    pass
-        print(f"found {elem.text}")
-        errno = ERR_NONE
-        if elem.text == "Access Restriction Notice":
-            errno = ERR_OVERLOAD
-        elif elem.text == "There was problem.":
-            errno = ERR_CART
-        return errno, elem
-
-
-class AnyEc:
-    """ Use with WebDriverWait to combine expected_conditions in an OR. """
-
-    def __init__(self, *args):
-        self.ecs = args
-
-    def __call__(self, driver):
-        for fn in self.ecs:
-            try:
-                res = fn(driver)
-                if res:
-                    return True
-            except:
-                pass
-
-
-def get_stealthy_driver(persist_session):
-    """
-    Returns a particularly stealthy webDriver.
-    :param persist_session:  Whether to save a persistent session to ./chrome_data
-    :return: Stealthified webdriver.
-    """
-    # Load up the browser
-    my_opts = webdriver.ChromeOptions()
-    my_opts.add_argument('--disable-blink-features=AutomationControlled')  # stealth-ify?
-    if persist_session:
-        my_opts.add_argument(f'user-data-dir={os.getcwd()}/chrome_data')
-
-    my_opts.add_experimental_option("excludeSwitches", ["enable-automation"])
-    my_opts.add_experimental_option('useAutomationExtension', False)
-    my_caps = DesiredCapabilities.CHROME
-    my_caps["pageLoadStrategy"] = "none"  # Avoid the automatic waiting on page load.
-
-    driver = Chrome(options=my_opts, desired_capabilities=my_caps)
-    stealth(driver,
-            languages=["en-US", "en"],
-            vendor="Google Inc.",
-            platform="Win32",
-            webgl_vendor="Intel Inc.",
-            renderer="Intel Iris OpenGL Engine",
-            fix_hairline=True,
-            )
-    return driver
-
-
-# If loop is true, continue sending requests until the item has successfully been added.
-# if throttled, we can either ignore the delay, switch to a really short
-def mt_request_wrapper(session, exit_flag: List, loop=True):
-    """
-    Wrapper function for the multithreaded sending of requests.
-    :param session: Requests session
-    :param exit_flag: Shared list of flags
-    :param loop: Whether to keep going after a failure or exit
-    :return: result of the last request
-    """
-
-    def _internal(method, url, initial_delay, **kargs):
-        sleep(initial_delay / 5)
-        print(f"Now ordering {kargs['json']['eparams'][1]}")
-        while True:
-            results = session.request(method, url, **kargs)
-            code = results.status_code
-            print(f"Status code {code} for ordering of {kargs['json']['eparams'][1]}")
-            if code == STATUS_SUCCESS:
-                _internal.loop = False
-                sleep(WAIT_TIME_AFTER_SUCCESS)
-                if not ORDER_ALL_AT_ONCE:  # update the exit flag if we are not ordering all at once, this will make the loop check and act accordingly.
-                    exit_flag.append(kargs['json']["scode"])
-            elif code == STATUS_UNAVAILABLE or code == STATUS_TOO_MUCH_TRAFFIC:
-                sleep(LOOP_WAIT_TIME_MS * 4 / 1000 * len(items_data_fumo))
-            elif code == STATUS_TROTTLED:
-                sleep(2)
-            if len(exit_flag):
-                _internal.loop = False
-            if not _internal.loop:
-                break
-            sleep(REQUESTOR_WAIT_MS / 1000)  # this is too short for regular operation, but i guess we assume that we succeed on the first try if not overloaded
-        return results
-
-    _internal.loop = loop
-    return _internal
-
-
-def generate_item_jsons_pre_order(base_request_data, items):
-    """
-    Generates the list of items in the JSON format required for API calls.
-    :param base_request_data: the base data for the request, necessary to include the session token.
-    :param items JSON formatted data of each item to be ordered.
-    :return: List of Json objects based on base_request_data and items
-    """
-    return [{**base_request_data, 'scode': item['scode'], 'amount': 1 if 'amount' not in item.keys() else min(item['amount'], item['max_cartin_count']),  # Verification step to ensure the requested amount is not above the maximal allowed quantity.
-             'eparams': [item['scode'], item['desc'], item['max_cartin_count']]} for item in items]
-
-
-def generate_item_jsons_check_info(items):
-    """
-    :param items JSON formatted data of each item.
-    :return: List of Json objects containing the basic item information required to retrieve the full item details.
-    """
-    return [{"lang": "eng", 'gcode': item['scode']} for item in items]
-
-
-if __name__ == '__main__':
-
-    carter = FumoCarter()
-
-    if SHOULD_AUTOLOGIN:
-        carter.account_login()
-    else:
-        # wait is necessary since without account_login, we jump straight to session_tokens which fails if the page hasn't even loaded once. so we wait for
-        sleep(2)
-
-    carter.get_session_tokens()
-
-    # Hijacking this script to place a simple test of the availability of the API from the current location, taking advantage of the logged-in state.
-    if TEST_API_AVAILABILITY:
-        carter.poll_api_for_availability()
-
-    if TEST_MODE:  # Whether to use the testing item list.
-        items_data = items_test_data
-    else:
-        items_data = items_data_fumo
-
-    item_jsons = generate_item_jsons_pre_order(base_request_data, items_data)
-    item_jsons_check_availablity = generate_item_jsons_check_info(items_data)
-
-    # We switch to the cart page, not strictly necessary.
-    carter.load_cart_page()
-    print("Initial setup: complete")
-
-    # Cautionary sleep.
-    sleep(1)
-
-    if WAIT_FOR_USER1:
-        input("Press enter to continue to the next step.")
-
-    carter.define_requests_session()
-
-    if WAIT_FOR_ITEMS:  # I recommend not using that live, it's wasting precious time verifying what we already know.
-        carter.wait_for_item_in_stock(item_jsons_check_availablity)
-
-    # At this point, we assume all items to be in stock, and try to add them all to cart. Threaded to minimize waiting time.
-    while len(item_jsons):  # loop until there are no more left.
-        carter.add_items_to_cart_api_mt(item_jsons)
-        carter.checkout()
+from time import perf_counter
+
+_started_at = perf_counter()  # as early as possible, so that the import time is part of the reported startup time.
+
+import asyncio
+import os
+import socket
+import threading
+from datetime import datetime
+from time import sleep, time
+from typing import Optional, Tuple, TYPE_CHECKING
+
+import requests
+from selenium.common.exceptions import TimeoutException, WebDriverException  # cheap, unlike anything under selenium.webdriver
+
+from fumo_cart import CartEngine, CartState
+from fumo_cdp import ResourceReport, block_resources, enable_performance_log
+from fumo_checkout import CHECKOUT_STEPS, CHECKOUT_STEP_MARKERS, ERROR_TEXTS, retry_policies
+from fumo_config import ConfigWatcher, current_config, generate_item_jsons_check_info
+from fumo_constants import *
+from fumo_dom import wait_for_any, run_form_actions
+from fumo_governor import RateGovernor
+from fumo_locators import LOCATORS, STEP_2_LOCATORS, js_locator, check_locators, error_locators
+from fumo_metrics import metrics
+from fumo_monitor import StockMonitor, ConditionalCache
+from fumo_ready import wait_until, pause
+from fumo_request_log import RequestLogWriter
+from fumo_snapshot import save_session_snapshot, load_session_snapshot
+from fumo_tokens import SessionTokens, TOKEN_NAMES
+from fumo_warmup import ConnectionWarmer, build_api_session
+
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webelement import WebElement
+
+metrics.record("startup.imports", perf_counter() - _started_at)
+
+
+class FumoCarter:
+    """
+    Class reponsible for the entirety of the ordering process.
+    """
+
+    def __init__(self, persist_session=RELOAD_SESSION, lazy_browser=False):
+        """
+        :param persist_session: Whether to save a persistent browser session to ./chrome_data
+        :param lazy_browser: Only launch the browser the first time it is needed, e.g. when the API session comes from a snapshot.
+        """
+        self.persist_session = persist_session
+        self._driver = None
+        self.order_counter = 0
+        self.session = None
+        self.cart_engine = None
+        self.warmer = None
+        self.tokens = SessionTokens()  # read by every request at send time, so they can be refreshed in place.
+        self.governor = RateGovernor()  # one rate limit for every API request, whichever part of the flow sends it.
+        self.resources = ResourceReport(RESOURCE_BLOCK_PROFILE) if RESOURCE_REPORT else None
+        self.config_watcher = ConfigWatcher()  # only watches once started, see HOT_RELOAD_CONFIG.
+        self.config_watcher.subscribe(self.on_config_reload)
+        if not lazy_browser:
+            self.launch_browser()
+
+    @property
+    def driver(self):
+        """
+        The browser, launched on first use.
+        """
+        if self._driver is None:
+            self.launch_browser()
+        return self._driver
+
+    def launch_browser(self):
+        """
+        Launches the browser, and loads the first page.
+        """
+        self._driver = get_stealthy_driver(self.persist_session, performance_log=RESOURCE_REPORT)
+        self._driver.set_script_timeout(DOM_WAIT_TIMEOUT_S + 5)  # the async DOM waits time out by themselves, this is only a safety net.
+        block_resources(self._driver, RESOURCE_BLOCK_PROFILES[RESOURCE_BLOCK_PROFILE])  # images, fonts and trackers only slow the checkout down.
+
+        # and we load up the page to setup cookies, sessions, and whatever else. required for the ability to order.
+        self._driver.get(USER_INFO_URL)
+
+    def on_config_reload(self, old, new):
+        """
+        Applies the settings which aren't read at use time.
+        """
+        if new.loop_wait_time_ms != old.loop_wait_time_ms:
+            rate = 1000 / new.loop_wait_time_ms
+            self.governor.reset_rate(rate, rate * API_RATE_MAX_PER_SECOND / API_RATE_PER_SECOND)
+
+    @metrics.timed("account_login")
+    def account_login(self):
+        """
+        Logs into the user account as defined in the constants.
+        """
+        # Actually, we do need to wait a little...
+        self.wait_until_present("submit")
+
+        # First, we have to log in, in order to retrieve the mcode (and avoid changing the ransu). mcodes seem static though
+        self.submit_login()
+        self.wait_until_present("account_ready")
+        self.wait_for_session_cookies()
+        print("Account succesfully logged in, probably")
+
+    def browser_login(self):
+        """
+        Gets a logged in session through the browser, and picks up its session tokens.
+        """
+        if SHOULD_AUTOLOGIN:
+            self.account_login()
+        else:
+            # without account_login, we jump straight to session_tokens which fails if the page hasn't even loaded once. so we wait for the cookies
+            self.wait_for_session_cookies()
+        self.get_session_tokens()
+
+    def wait_for_session_cookies(self) -> bool:
+        """
+        Waits until the browser holds the cookies of both session tokens, timed under ready.session_cookies.
+        :return: Whether they showed up within DOM_WAIT_TIMEOUT_S
+        """
+        names = set(TOKEN_NAMES)
+        return bool(wait_until(lambda: names <= {cookie["name"] for cookie in self.driver.get_cookies()}, "session_cookies"))
+
+    def wait_until_present(self, name) -> "WebElement":
+        """
+        Waits until the element of the named locator is present.
+        :raises TimeoutException: if it didn't show up within DOM_WAIT_TIMEOUT_S
+        """
+        return wait_for_any(self.driver, [js_locator(name)], DOM_WAIT_TIMEOUT_S, DOM_WAIT_MODE, DOM_WAIT_POLL_S)[1]
+
+    def submit_login(self):
+        """
+        Submits login information on the current page.
+        """
+        username = self.driver.find_element(*LOCATORS["login_email"])
+        username.send_keys(USERNAME)
+        password = self.driver.find_element(*LOCATORS["login_password"])
+        password.send_keys(PASSWORD)
+        form = self.driver.find_element(*LOCATORS["submit"])
+        form.submit()
+
+    @metrics.timed("get_session_tokens")
+    def get_session_tokens(self):
+        """
+        Retrieves relevant session tokens from the browser's cookies into the token store.
+        """
+        cookies = {cookie["name"]: cookie["value"] for cookie in self.driver.get_cookies()}
+        self.tokens.refresh_from_cookies(cookies)
+        print(f"Tokens: {self.tokens.get()}")
+        if self.tokens.mcode is None:
+            print("Error! mcode is None")
+        print("")
+
+    def load_cart_page(self):
+        """
+        Loads the cart webpage.
+        """
+        self.driver.get(CART_PAGE_URL)
+        # XPath for page specific item to identify successful loading of the page.
+        self.wait_until_present("cart_page_title")
+
+    @metrics.timed("define_requests_session")
+    def define_requests_session(self, cookies=None):
+        """
+        Creates a `requests` session with the correct paramters to query the API.
+        The connections to the API are opened right away and kept alive, with one pooled connection per cart worker.
+        :param cookies: Cookies in the format of driver.get_cookies(), taken from the browser by default.
+        """
+        self.session = build_api_session(CART_WORKERS)
+        self.session.headers.update(headers)
+        for cookie in self.driver.get_cookies() if cookies is None else cookies:
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
+        # the cart workers are started now, so that none of that happens after the items are detected.
+        if self.cart_engine is not None:
+            self.cart_engine.stop()
+        self.cart_engine = CartEngine(self.session, self.tokens, self.governor)
+        if self.warmer is not None:
+            self.warmer.stop()
+        self.warmer = None
+        if PREWARM_CONNECTIONS:
+            self.warmer = ConnectionWarmer(self.session, API_CART_URL, CART_WORKERS, governor=self.governor)
+            self.warmer.warm_up()
+            self.warmer.start()
+
+    def save_session_snapshot(self):
+        """
+        Saves the API session and tokens to SESSION_SNAPSHOT_PATH, so that the next run can skip the browser login.
+        """
+        save_session_snapshot(SESSION_SNAPSHOT_PATH, self.session, self.tokens.get())
+        print(f"Session snapshot saved to {SESSION_SNAPSHOT_PATH}")
+
+    @metrics.timed("restore_session_snapshot")
+    def restore_session_snapshot(self) -> bool:
+        """
+        Sets up the session tokens and the requests session from a snapshot instead of the browser.
+        :return: Whether a usable snapshot was found, if not the browser path has to be taken.
+        """
+        snapshot = load_session_snapshot(SESSION_SNAPSHOT_PATH, SESSION_SNAPSHOT_MAX_AGE_S)
+        if snapshot is None:
+            return False
+        self.tokens.update(**snapshot["tokens"])
+        self.define_requests_session(snapshot["cookies"])
+        print("Session restored from the snapshot, the browser will be launched once it is needed.")
+        return True
+
+    def refresh_tokens(self, probe=False) -> bool:
+        """
+        Refreshes the token store from the requests session, without going through the browser.
+        :param probe: Also send a cheap item info request first, to pick up any token the server wants to hand out.
+        :return: Whether the tokens changed.
+        """
+        if probe:
+            item = generate_item_jsons_check_info(items_test_data)[0]
+            try:
+                self.session.request("GET", API_GET_ITEM_INFO_URL, headers=headers, params=self.tokens.apply(item, ("ransu",)), timeout=API_REQUEST_TIMEOUT_S)
+            except requests.RequestException as e:
+                print(f"Token probe failed: {e!r}")
+        return self.tokens.refresh_from_cookies({cookie.name: cookie.value for cookie in self.session.cookies})
+
+    @metrics.timed("detection")
+    def wait_for_item_in_stock(self, items_jsons_check_availablity):
+        """
+        Waits until at least one of the items in the list is in stock.
+        All the items are polled concurrently by a StockMonitor, within a single shared request budget.
+        :return: The item info of the item which was detected, or None if we stopped because of throttling.
+        """
+        monitor = StockMonitor(headers, self.session.cookies.get_dict(), self.governor)
+        item = asyncio.run(monitor.wait_for_cart_type(items_jsons_check_availablity, self.tokens))
+        print("Fumo Detected\n")
+        return item
+
+    @metrics.timed("cart_add_all")
+    def add_items_to_cart_api_mt(self, items_jsons):
+        """
+        Attempts to add all the items in the list to the cart. Only items that have been successfully added will be removed from the list.
+        This is the multithreaded version, the work is handed to the long-lived cart engine.
+        :return: Table of the last response for each scode.
+        """
+        self.refresh_tokens()
+        results = self.cart_engine.add_items(items_jsons)
+        self.process_cart_results(items_jsons, results)
+        return results
+
+    @metrics.timed("detection_and_cart_add")
+    def detect_and_add_items(self, items_jsons, items_jsons_check_availablity, on_in_stock=None):
+        """
+        Pipelined version of wait_for_item_in_stock followed by add_items_to_cart_api_mt.
+        Every item is handed to the cart workers the moment it's detected in stock, while the others keep being monitored.
+        Items which were never detected (the monitor got throttled, or the batch was stopped) are attempted at the end anyway, like before.
+        Only items that have been successfully added will be removed from the list.
+        :param on_in_stock: Called with the scode of each detected item, right after it went to the cart workers.
+        :return: Table of the last response for each scode.
+        """
+        self.refresh_tokens()
+        round_items = {item['scode']: item for item in items_jsons}  # replaced as a whole on config reloads
+        submitted = set()
+        closed = False  # once the monitor is done, reloads are left to the next round.
+        lock = threading.Lock()
+        batch = self.cart_engine.start_batch(items_jsons)
+        monitor = StockMonitor(headers, self.session.cookies.get_dict(), self.governor)
+
+        def on_detect(item_check_info, vals, detected_at):
+            scode = item_check_info['gcode']
+            item = round_items.get(scode)
+            if item is not None and scode not in submitted:
+                submitted.add(scode)
+                self.cart_engine.submit(batch, item, detected_at=detected_at)
+                if on_in_stock is not None:
+                    on_in_stock(scode)
+
+        def on_config_reload(old, new):
+            """
+            New items join the round right away, removed ones leave it. Changed amounts are up to the next round, which reads the cart again.
+            """
+            nonlocal round_items
+            old_scodes = {item['scode'] for item in old.item_jsons}
+            wanted = {item['scode']: item for item in new.item_jsons}
+            with lock:
+                if closed:
+                    return
+                added = [item for scode, item in wanted.items() if scode not in old_scodes and scode not in round_items]
+                removed = [scode for scode in round_items if scode not in wanted]
+                kept = {scode: {**wanted[scode], 'amount': item['amount']} for scode, item in round_items.items() if scode in wanted}
+                added = [item for item in added if batch.add(item)]
+                for item in kept.values():
+                    batch.update(item)
+                for scode in removed:
+                    batch.remove(scode)
+                round_items = {**kept, **{item['scode']: item for item in added}}
+                monitor.update_items(generate_item_jsons_check_info(added), removed)
+            if added or removed:
+                print(f"Watch list updated: {len(added)} added, {len(removed)} removed")
+
+        self.config_watcher.subscribe(on_config_reload)
+        try:
+            asyncio.run(monitor.wait_for_cart_type(items_jsons_check_availablity, self.tokens, on_detect=on_detect, stop=batch.cancelled))
+        finally:
+            self.config_watcher.unsubscribe(on_config_reload)
+            with lock:
+                closed = True
+        for scode, item in round_items.items():
+            if scode in submitted:
+                continue
+            if batch.cancelled.is_set():  # something made it to the cart already, the workers would only drop it
+                batch.finish(scode, None)
+            else:
+                self.cart_engine.submit(batch, item)
+        for scode in batch.results:
+            if scode not in round_items and scode not in submitted:  # removed by a reload before it was detected
+                batch.finish(scode, None)
+        batch.done.wait()
+        self.process_cart_results(items_jsons, batch.results)
+        return batch.results
+
+    def process_cart_results(self, items_jsons, results):
+        """
+        Removes the items which made it to the cart from the list.
+        :param results: Result table of a cart batch, scode -> last response
+        """
+        succeeded = {scode for scode, response in results.items() if response is not None and response.status_code == STATUS_SUCCESS}
+        if len(succeeded) != len(results):
+            print("Not all fumos passed. what is currently in the cart has been removed from the list, and will be processed after this order goes through.")
+            for scode in succeeded:
+                print(f"Removed {scode} from item_jsons")
+            items_jsons[:] = [item for item in items_jsons if item['scode'] not in succeeded]
+        else:
+            print("All fumo successfully added!\n")
+        if CART_ONLY_MODE:  # testing flag to block off the checkout process.
+            print("You are in cart only mode, script execution stopped.")
+            while True:
+                sleep(1)
+
+    def add_items_to_cart_api_st(self, items_jsons):
+        """
+        Singlethreaded, simpler version of add_items_to_cart_api_mt
+        """
+        for item in items_jsons:
+            response = self.driver.request("POST", API_CART_URL, headers=headers, json=self.tokens.apply(item))
+            print(f"Responose for {item} is {response} ")
+
+    @metrics.timed("checkout")
+    def checkout(self):
+        """
+        Entirely self-contained handling of the checkout process, assumes that the cort does contain items at this point.
+        Consists of the checkout flow of the target website, run as a state machine: every time a page loads, we check which step it is
+        and carry on from there. After an error, the checkout page is loaded again after the backoff of the failed step (CHECKOUT_RETRY_POLICIES),
+        resuming wherever the site puts us rather than redoing every step from the login.
+        Attempts and errors of each step are counted under checkout.<step>.*, waits are timed under checkout.wait.<page>.
+        """
+
+        @metrics.timed("checkout.login")
+        def checkout_login():
+            self.submit_login()
+
+        @metrics.timed("checkout.part_1")
+        def checkout_part_1():
+            """
+            Handles the first part of the checkout process, "rearrangement options".
+            """
+            form = self.driver.find_element(*LOCATORS["submit"])
+            form.click()
+
+        @metrics.timed("checkout.part_2")
+        def checkout_part_2():
+            """
+            Handles the second part of the checkout process, "Payment & Shipping".
+            """
+
+            def checkout_select_payment_method():
+                """
+                Selects the correct payment method
+                """
+                from selenium.webdriver.support.ui import Select  # only needed on this fallback path
+
+                form = self.driver.find_element(*LOCATORS["payment_card"])
+                form.click()
+                # Fill in credit card info
+                try:
+                    self.driver.find_element(*LOCATORS["card_number"]).send_keys(CARD_NUMBER)
+                    self.driver.find_element(*LOCATORS["card_owner"]).send_keys(CARD_OWNER)
+                    self.driver.find_element(*LOCATORS["security_code"]).send_keys(SECURITY_CODE)
+                    self.wait_until_present("card_type")
+                    Select(self.driver.find_element(*LOCATORS["card_type"])).select_by_index(CARD_TYPE)  # Visa is 0, mastercard is 1
+                    Select(self.driver.find_element(*LOCATORS["exp_year"])).select_by_value(EXP_YEAR)  # The year
+                    Select(self.driver.find_element(*LOCATORS["exp_month"])).select_by_value(EXP_MONTH)  # The month
+                except Exception:  # or don't if it's already in there. There is no other cause for errors besides pre-filled credit card data at this stage, so ignoring it is fine.
+                    pass
+
+            def checkout_select_shipping():
+                """
+                Selects the appropriate shipping method
+                """
+                if current_config().dhl:
+                    form = self.driver.find_element(*LOCATORS["shipping_dhl"])  # DHL - pain
+                else:
+                    form = self.driver.find_element(*LOCATORS["shipping_surface"])  # Surface parcel - slow
+                form.click()
+
+            def checkout_fill_batched() -> bool:
+                """
+                Selects the shipping and payment methods and fills in the credit card info, all in a single script execution.
+                :return: Whether it worked, if not the per-element path has to be used.
+                """
+                actions = [["click", js_locator("shipping_dhl" if current_config().dhl else "shipping_surface")],
+                           ["click", js_locator("payment_card")],
+                           ["wait", js_locator("card_type"), 2000],  # the card fields only show up after the payment method is picked
+                           ["value", js_locator("card_number"), CARD_NUMBER],
+                           ["value", js_locator("card_owner"), CARD_OWNER],
+                           ["value", js_locator("security_code"), SECURITY_CODE],
+                           ["select_index", js_locator("card_type"), CARD_TYPE],
+                           ["select_value", js_locator("exp_year"), EXP_YEAR],
+                           ["select_value", js_locator("exp_month"), EXP_MONTH]]
+                try:
+                    results = run_form_actions(self.driver, actions)
+                except WebDriverException as e:
+                    print(f"Batched form fill failed: {e!r}")
+                    return False
+                # same as the per-element path, failing on the card fields is fine since they might be pre-filled. the two methods are not.
+                if not all(results[:2]):
+                    missing = [name for name, present in check_locators(self.driver, STEP_2_LOCATORS).items() if not present]
+                    print(f"Batched form fill failed, missing: {missing}")
+                    return False
+                return True
+
+            if not (BATCHED_FORM_FILL and checkout_fill_batched()):
+                checkout_select_shipping()
+
+                # Select payment method and fill relevant information if CC.
+                checkout_select_payment_method()
+
+            # Finally, submit the form.
+            self.driver.find_element(*LOCATORS["submit"]).click()
+
+        def checkout_place_order() -> bool:
+            """
+            The last part, the confirmation. The order only counts once the site confirms it.
+            :return: True once we're done, False if the site answered with an error page, which the loop then backs off from.
+            :raises TimeoutException: if neither the confirmation nor an error showed up, the loop backs off from that too.
+            """
+            if not current_config().finish_order:
+                return True
+            with metrics.timed("checkout.place_order"):
+                self.driver.find_element(*LOCATORS["submit"]).click()  # Place order!
+            with metrics.timed("ready.order_complete"):
+                index, _, text = wait_for_any(self.driver, [js_locator("order_complete")] + error_locators(),
+                                              DOM_WAIT_TIMEOUT_S, DOM_WAIT_MODE, DOM_WAIT_POLL_S)
+            if index != 0:  # still on the error page when the loop looks again, so it counts as a failed step_3.
+                print(f"Placing the order failed: {text}")
+                return False
+            self.order_counter += 1
+            self.driver.save_screenshot(f"proof_of_order_{self.order_counter}.png")
+            return True
+
+        actions = {"login": checkout_login, "step_1": checkout_part_1, "step_2": checkout_part_2, "step_3": checkout_place_order}
+        policies = retry_policies(CHECKOUT_RETRY_POLICIES)
+        failures = {step: 0 for step in policies}
+        attempting = "load"  # the step whose result we're waiting for
+        done_step = None  # the step we just went through, its page can linger for a while after the submit
+
+        # speedy checkout
+        with metrics.timed("checkout.load"):
+            self.driver.get(CART_CHECKOUT_URL)
+        while True:
+            start = perf_counter()
+            try:
+                state, elem = self.detect_checkout_page(exclude=done_step)
+            except TimeoutException:
+                state, elem = "timeout", None
+            metrics.record(f"checkout.wait.{state}", perf_counter() - start)
+            if self.resources is not None:
+                self.resources.collect(self.driver, state)
+            if state in CHECKOUT_STEPS:
+                failures[attempting] = 0
+                attempting = state
+                metrics.count(f"checkout.{state}.attempts")
+                try:
+                    if actions[state]():
+                        break
+                    done_step = state
+                    continue
+                except TimeoutException:  # the step never got an answer, same as a page that never showed up
+                    state, elem = "timeout", None
+            done_step = None  # we reload from here, landing on the same step again is fine
+
+            # something went wrong while going through the step we were attempting. back off, then pick up from wherever the site puts us.
+            failures[attempting] += 1
+            metrics.count(f"checkout.{attempting}.{state}")
+            delay = policies[attempting].delay(failures[attempting])
+            print(f"Checkout {state} after {attempting}, failure #{failures[attempting]}. Resuming in {delay:.2f}s")
+            pause(delay, "checkout_backoff")
+            if state == "cart_error":
+                elem.click()  # the return button, which sends us back to the checkout
+            else:
+                with metrics.timed("checkout.load"):
+                    self.driver.get(CART_CHECKOUT_URL)
+
+        if self.resources is not None:
+            self.resources.write()
+
+    # Various helper methods and tools. could be extracted.
+    def poll_api_for_availability(self):
+        """
+        Polls the website API and logs the response status to monitor availability and reliability.
+        Results are streamed to REQUEST_LOG_PATH, use fumo_request_log.py to summarize them.
+        Goes through the shared rate governor, which is what slows it down on 429 and 503.
+        Loops indefinitely.
+        """
+        item = generate_item_jsons_check_info(items_test_data)[0]
+        conditional = ConditionalCache()  # we only look at the status, no need to download the same document over and over.
+        if self.session is None:
+            self.define_requests_session()  # define the requests session
+        with RequestLogWriter(REQUEST_LOG_PATH, LOG_TO_FILE_FREQUENCY, REQUEST_LOG_MAX_BYTES, REQUEST_LOG_BACKUPS) as request_log:
+            while True:
+                self.governor.acquire()
+                sent_at = time()
+                try:
+                    response = self.session.request("GET", API_GET_ITEM_INFO_URL, headers={**headers, **conditional.request_headers(item['gcode'])},
+                                                    params=self.tokens.apply(item, ("ransu",)), timeout=API_REQUEST_TIMEOUT_S)
+                    content = response.content
+                except requests.RequestException as e:  # logged like any other answer, that's exactly what we're here to find out about.
+                    request_log.write(sent_at, time() - sent_at, STATUS_NO_RESPONSE)
+                    print(f"Request at {datetime.now().strftime('%H:%M:%S')} failed: {e!r}")
+                    continue
+                self.tokens.refresh_from_cookies(response.cookies)
+                self.governor.on_response(response.status_code, response.headers.get("Retry-After"))
+                metrics.count("availability.bytes", len(content))
+                if response.status_code == STATUS_SUCCESS:
+                    conditional.store(item['gcode'], response.headers, None)
+                request_log.write(sent_at, response.elapsed.total_seconds(), response.status_code)
+                c_time = datetime.now().strftime("%H:%M:%S")
+                code = response.status_code
+                print(f"Response at {c_time} was [{code}]")
+                if code == STATUS_SUCCESS or code == STATUS_NOT_MODIFIED:
+                    sleep(current_config().loop_wait_time_ms / 1000)  # the probe keeps its own pace, however much the governor would allow.
+
+    def detect_checkout_page(self, exclude: Optional[str] = None) -> Tuple[str, "WebElement"]:
+        """
+        Waits until the page shows either one of the checkout steps or an error, and tells which one it is.
+        Resolves in a single WebDriver round trip in the default "observer" mode, see fumo_dom.wait_for_any.
+        :param exclude: A step to ignore, the one just submitted. Without a page load strategy, its page stays up until the next one
+                        comes in, and would be detected (and submitted) again.
+        :return: (one of CHECKOUT_STEPS, "overload" or "cart_error", the matched element)
+        :raises TimeoutException: if nothing showed up within DOM_WAIT_TIMEOUT_S
+        """
+        # errors first, so that they take priority over the steps, then the steps from the last one.
+        steps = [step for step in reversed(CHECKOUT_STEPS) if step != exclude]
+        states = ["alert", "error"] + steps
+        locators = error_locators() + [js_locator(CHECKOUT_STEP_MARKERS[step]) for step in steps]
+        index, elem, text = wait_for_any(self.driver, locators, DOM_WAIT_TIMEOUT_S, DOM_WAIT_MODE, DOM_WAIT_POLL_S)
+        state = states[index]
+        print(f"found {state}: {text}")
+        if state in ("alert", "error"):
+            state = ERROR_TEXTS.get(text, "overload")  # an error we don't know about, reloading is the safest bet.
+            if state == "cart_error":
+                elem = self.driver.find_element(*LOCATORS["back"])
+        return state, elem
+
+
+def debugger_reachable(address, timeout_s=0.2) -> bool:
+    """
+    Checks whether a browser is listening on the given remote debugging address, without waiting on chromedriver to find out.
+    :param address: host:port
+    """
+    host, port = address.rsplit(":", 1)
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout_s):
+            return True
+    except OSError:
+        return False
+
+
+@metrics.timed("browser_launch")
+def get_stealthy_driver(persist_session, debugger_address=BROWSER_DEBUGGER_ADDRESS, performance_log=False):
+    """
+    Returns a particularly stealthy webDriver.
+    If a debugger address is given and a browser is already listening there, we attach to it instead of launching a new one, which keeps
+    its logged in session. Otherwise the new browser listens on that address and outlives this process, so that the next run can attach.
+    :param persist_session:  Whether to save a persistent session to ./chrome_data
+    :param debugger_address: host:port of the browser's remote debugging, None to always launch a fresh browser.
+    :param performance_log: Keep the DevTools network events, for the resource report.
+    :return: Stealthified webdriver.
+    """
+    # selenium.webdriver and friends take a good while to import, so we only do it once we actually need a browser.
+    from selenium import webdriver
+    from selenium.webdriver import DesiredCapabilities
+    from selenium_stealth import stealth
+    from seleniumrequests import Chrome
+
+    my_opts = webdriver.ChromeOptions()
+    my_caps = DesiredCapabilities.CHROME
+    my_caps["pageLoadStrategy"] = "none"  # Avoid the automatic waiting on page load.
+    if performance_log:
+        enable_performance_log(my_caps)
+
+    if debugger_address and debugger_reachable(debugger_address):
+        print(f"Attaching to the browser at {debugger_address}")
+        my_opts.add_experimental_option("debuggerAddress", debugger_address)
+    else:
+        # Load up the browser
+        my_opts.add_argument('--disable-blink-features=AutomationControlled')  # stealth-ify?
+        if persist_session:
+            my_opts.add_argument(f'user-data-dir={os.getcwd()}/chrome_data')
+        if debugger_address:
+            my_opts.add_argument(f'--remote-debugging-port={debugger_address.rsplit(":", 1)[1]}')
+            my_opts.add_experimental_option("detach", True)  # keep it running after we're gone, ready for the next run to attach.
+
+        my_opts.add_experimental_option("excludeSwitches", ["enable-automation"])
+        my_opts.add_experimental_option('useAutomationExtension', False)
+
+    driver = Chrome(options=my_opts, desired_capabilities=my_caps)
+    # also when attaching, the scripts injected by a previous chromedriver session don't survive it.
+    stealth(driver,
+            languages=["en-US", "en"],
+            vendor="Google Inc.",
+            platform="Win32",
+            webgl_vendor="Intel Inc.",
+            renderer="Intel Iris OpenGL Engine",
+            fix_hairline=True,
+            )
+    return driver
+
+
+def fill_cart_and_check_out(carter: FumoCarter, check_out, pipelined, on_in_stock=None):
+    """
+    Adds the items to the cart and checks out, until everything targeted has been ordered.
+    What to add comes from the cart itself: only what's missing is sent, and we only check out when the cart changed.
+    The items are those of the current config, read again every round so that reloads are picked up.
+    :param check_out: Called with the targeted cart contents whenever there is something new to check out, returns once it's done.
+    :param pipelined: Monitor the missing items and cart each of them the moment it's detected, rather than sending them right away.
+    :param on_in_stock: Passed on to detect_and_add_items.
+    """
+    cart = CartState(carter.session, carter.tokens, list(current_config().item_jsons), carter.governor)
+    checked_out = {}
+    while True:
+        cart.retarget(list(current_config().item_jsons))
+        missing = cart.missing()
+        if missing:
+            if pipelined:
+                results = carter.detect_and_add_items(list(missing), generate_item_jsons_check_info(missing), on_in_stock)
+            else:
+                results = carter.add_items_to_cart_api_mt(list(missing))
+            cart.record_adds(results, missing)
+        cart.retarget(list(current_config().item_jsons))  # items which joined while the round ran are in the cart too
+        contents = cart.targeted_contents(refresh=True)
+        if contents and contents != checked_out:
+            # a failed checkout leaves the cart as it was, which would look like nothing new to check out. go again while that's the case.
+            for attempt in range(1, CHECKOUT_ATTEMPTS + 1):
+                check_out(contents)
+                left = cart.record_checkout(contents)
+                if left is None:  # adding the items again could order them twice, this needs a human.
+                    print("Stopping here, check the orders and the cart by hand.")
+                    return
+                if not left or not current_config().finish_order:
+                    break
+                metrics.count("checkout.left_in_cart")
+                print(f"The checkout left {left} in the cart (attempt {attempt}/{CHECKOUT_ATTEMPTS})")
+            checked_out = contents
+        elif not missing:
+            break
+
+
+def main():
+    """
+    The whole ordering process, from the login to the last checkout.
+    """
+    carter = FumoCarter(lazy_browser=USE_SESSION_SNAPSHOT)
+    restored = USE_SESSION_SNAPSHOT and carter.restore_session_snapshot()
+
+    if not restored:
+        carter.browser_login()
+
+    startup = perf_counter() - _started_at
+    metrics.record("startup.session_ready", startup)
+    print(f"Startup took {startup:.2f}s")
+
+    # Hijacking this script to place a simple test of the availability of the API from the current location, taking advantage of the logged-in state.
+    if TEST_API_AVAILABILITY:
+        carter.poll_api_for_availability()
+
+    # the item list (test or not, see TEST_MODE) and the settings which can change while running. edit the files, no need to restart.
+    if HOT_RELOAD_CONFIG:
+        carter.config_watcher.start()
+
+    if not restored:
+        # We switch to the cart page, not strictly necessary.
+        carter.load_cart_page()
+        print("Initial setup: complete")
+
+    if WAIT_FOR_USER1:
+        input("Press enter to continue to the next step.")
+
+    if not restored:
+        carter.define_requests_session()
+        if USE_SESSION_SNAPSHOT:
+            carter.save_session_snapshot()
+
+    pipelined = WAIT_FOR_ITEMS and PIPELINED_CART  # each item goes to the cart the moment it's detected, the others keep being monitored.
+    if WAIT_FOR_ITEMS and not pipelined:  # I recommend not using that live, it's wasting precious time verifying what we already know.
+        carter.wait_for_item_in_stock(list(current_config().item_jsons_check_info))
+
+    fill_cart_and_check_out(carter, lambda contents: carter.checkout(), pipelined)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:  # the report is most interesting exactly when something went wrong.
+        metrics.write_report(METRICS_REPORT_BASENAME)
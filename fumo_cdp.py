@@ -0,0 +1,92 @@
+import json
+import os
+from typing import Dict, List
+
+from fumo_metrics import metrics
+
+
+def block_resources(driver, patterns: List[str]):
+    """
+    Makes the browser skip every request matching one of the patterns, before it even leaves the machine.
+    Goes through the DevTools protocol, so it applies to the current tab only, and has to be redone after attaching to a browser.
+    :param patterns: URL patterns as taken by Network.setBlockedURLs, "*" being the wildcard.
+    """
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(patterns)})
+    if patterns:
+        print(f"Blocking {len(patterns)} resource patterns")
+
+
+def enable_performance_log(capabilities: dict):
+    """
+    Has chromedriver keep the DevTools network events, which is where ResourceReport gets its numbers from.
+    """
+    capabilities["goog:loggingPrefs"] = {"performance": "ALL"}
+
+
+class ResourceReport:
+    """
+    Requests, bytes and blocked requests of each checkout page, taken from chrome's performance log.
+    Compare the reports of two profiles (e.g. "none" and "checkout") to see what the blocking saves.
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.pages: Dict[str, Dict[str, int]] = {}
+
+    def collect(self, driver, page):
+        """
+        Drains the performance log, and attributes everything in it to the given page.
+        :param page: Name of the page the requests belong to, e.g. the checkout step that just showed up.
+        """
+        stats = self.pages.setdefault(page, {"loads": 0, "requests": 0, "blocked": 0, "failed": 0, "bytes": 0})
+        stats["loads"] += 1
+        for entry in driver.get_log("performance"):
+            message = json.loads(entry["message"])["message"]
+            method, params = message.get("method"), message.get("params", {})
+            if method == "Network.requestWillBeSent":
+                stats["requests"] += 1
+            elif method == "Network.loadingFinished":
+                stats["bytes"] += int(params.get("encodedDataLength", 0))
+            elif method == "Network.loadingFailed":
+                stats["blocked" if params.get("blockedReason") else "failed"] += 1
+
+    def as_dict(self) -> dict:
+        """
+        :return: Per page totals and averages per load, along with how long each page took to show up.
+        """
+        waits = metrics.snapshot()
+        pages = {}
+        for page, stats in self.pages.items():
+            loads = stats["loads"] or 1
+            wait = waits.get(f"checkout.wait.{page}")
+            pages[page] = {**stats,
+                           "requests_per_load": stats["requests"] / loads,
+                           "blocked_per_load": stats["blocked"] / loads,
+                           "bytes_per_load": stats["bytes"] / loads,
+                           "wait_p50_s": wait["p50_s"] if wait else None}
+        return {"profile": self.profile, "pages": pages}
+
+    def write(self, path_format="resource_report_{}.json", baseline="none"):
+        """
+        Writes the report, and prints what changed per page against the report of the baseline profile, if there is one.
+        """
+        report = self.as_dict()
+        with open(path_format.format(self.profile), "w") as f:
+            json.dump(report, f, indent=2)
+        baseline_path = path_format.format(baseline)
+        if self.profile == baseline or not os.path.exists(baseline_path):
+            return
+        with open(baseline_path) as f:
+            base = json.load(f)["pages"]
+        print(f"\n{'page':<12}{'requests saved':>16}{'bytes saved':>14}{'wait p50 change':>18}")
+        for page, stats in report["pages"].items():
+            if page not in base:
+                continue
+            sent = stats["requests_per_load"] - stats["blocked_per_load"]  # blocked requests are still announced, they just never go out.
+            saved_requests = base[page]["requests_per_load"] - sent
+            saved_bytes = base[page]["bytes_per_load"] - stats["bytes_per_load"]
+            wait_change = float("nan")
+            if stats["wait_p50_s"] is not None and base[page]["wait_p50_s"] is not None:
+                wait_change = stats["wait_p50_s"] - base[page]["wait_p50_s"]
+            print(f"{page:<12}{saved_requests:>16.1f}{saved_bytes:>14.0f}{wait_change:>18.3f}")
@@ -0,0 +1,48 @@
+from typing import Dict, Tuple
+
+# The steps of the checkout, in order, with the locator of the element which tells each of them apart.
+CHECKOUT_STEPS = ("login", "step_1", "step_2", "step_3")
+CHECKOUT_STEP_MARKERS = {
+    "login": "login_password",
+    "step_1": "step_1_return",
+    "step_2": "step_2_radio",  # radio buttons are only included in the second part of the checkout iirc
+    "step_3": "place_order",
+}
+
+# What the error elements say, mapped to the kind of error.
+ERROR_TEXTS = {
+    "Access Restriction Notice": "overload",
+    "There was problem.": "cart_error",
+}
+
+
+class RetryPolicy:
+    """
+    Exponential backoff for a single checkout step, based on how many times in a row it failed.
+    """
+
+    def __init__(self, backoff_s, factor=2.0, max_backoff_s=5.0):
+        """
+        :param backoff_s: Wait after the first failure.
+        :param factor: Every further failure multiplies the wait by this much.
+        :param max_backoff_s: Upper bound of the wait.
+        """
+        self.backoff_s = backoff_s
+        self.factor = factor
+        self.max_backoff_s = max_backoff_s
+
+    def delay(self, failures) -> float:
+        """
+        :param failures: Consecutive failures of the step, including the one that just happened.
+        :return: Time to wait before trying the step again.
+        """
+        if failures <= 0:
+            return 0.0
+        return min(self.backoff_s * self.factor ** (failures - 1), self.max_backoff_s)
+
+
+def retry_policies(config: Dict[str, Tuple[float, float, float]]) -> Dict[str, RetryPolicy]:
+    """
+    :param config: step -> (backoff_s, factor, max_backoff_s), as in CHECKOUT_RETRY_POLICIES
+    """
+    return {step: RetryPolicy(*values) for step, values in config.items()}
@@ -0,0 +1,224 @@
+import json
+import math
+import os
+import threading
+from time import perf_counter, time
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+import fumo_constants
+from fumo_constants import *
+from fumo_metrics import metrics
+
+# The settings which can be overridden in SETTINGS_PATH, and their types. Anything not in the file keeps its value from fumo_constants.
+SETTINGS = {
+    "TEST_MODE": bool,
+    "FINISH_ORDER": bool,  # follows TEST_MODE unless given, as in fumo_constants
+    "DHL": bool,
+    "ORDER_ALL_AT_ONCE": bool,
+    "LOOP_WAIT_TIME_MS": float,
+    "REQUESTOR_WAIT_MS": float,
+    "WAIT_TIME_AFTER_SUCCESS": float,
+}
+# the lowest value each numeric setting may take. LOOP_WAIT_TIME_MS sets the request rate, which 0 would make infinite.
+SETTING_MINIMUMS = {
+    "LOOP_WAIT_TIME_MS": 1,
+    "REQUESTOR_WAIT_MS": 0,
+    "WAIT_TIME_AFTER_SUCCESS": 0,
+}
+
+
+class RuntimeConfig(NamedTuple):
+    """
+    The part of the configuration which can change while running: the watched items and the settings of SETTINGS.
+    Never modified, a reload swaps in a new one, so whoever reads it gets either all of the old values or all of the new ones.
+    """
+    test_mode: bool
+    finish_order: bool
+    dhl: bool
+    order_all_at_once: bool
+    loop_wait_time_ms: float
+    requestor_wait_ms: float
+    wait_time_after_success: float
+    item_jsons: Tuple[dict, ...]  # as generated by generate_item_jsons_pre_order
+    item_jsons_check_info: Tuple[dict, ...]  # as generated by generate_item_jsons_check_info
+    version: int = 0
+
+
+def generate_item_jsons_pre_order(base_request_data, items):
+    """
+    Generates the list of items in the JSON format required for API calls.
+    :param base_request_data: the base data for the request. The session tokens are added at send time, from the token store.
+    :param items JSON formatted data of each item to be ordered.
+    :return: List of Json objects based on base_request_data and items
+    """
+    return [{**base_request_data, 'scode': item['scode'], 'amount': 1 if 'amount' not in item.keys() else min(item['amount'], item['max_cartin_count']),  # Verification step to ensure the requested amount is not above the maximal allowed quantity.
+             'eparams': [item['scode'], item['desc'], item['max_cartin_count']]} for item in items]
+
+
+def generate_item_jsons_check_info(items):
+    """
+    :param items JSON formatted data of each item.
+    :return: List of Json objects containing the basic item information required to retrieve the full item details.
+    """
+    return [{"lang": "eng", 'gcode': item['scode']} for item in items]
+
+
+def load_settings(path) -> dict:
+    """
+    :return: The overrides in the settings file, empty if there is no such file.
+    :raises ValueError: if the file is not valid JSON, or has unknown settings or values of the wrong type or out of range.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        settings = json.load(f)
+    for name, value in settings.items():
+        if name not in SETTINGS:
+            raise ValueError(f"Unknown setting {name}, expected one of {', '.join(SETTINGS)}")
+        expected = SETTINGS[name]
+        # bools are ints as far as python is concerned, and ints are fine for floats.
+        if isinstance(value, bool) != (expected is bool) or not isinstance(value, (int, float) if expected is float else expected):
+            raise ValueError(f"{name} should be a {expected.__name__}, got {value!r}")
+        if expected is float and not (math.isfinite(value) and value >= SETTING_MINIMUMS.get(name, -math.inf)):
+            raise ValueError(f"{name} should be a finite number of at least {SETTING_MINIMUMS.get(name, '-inf')}, got {value!r}")
+    return settings
+
+
+def load_runtime_config(data_path=FUMO_DATA_PATH, settings_path=SETTINGS_PATH, version=0) -> RuntimeConfig:
+    """
+    Reads the items from fumo_data.json and the settings from the settings file, on top of the defaults of fumo_constants.
+    :raises ValueError: if either file is invalid.
+    """
+    settings = {name: getattr(fumo_constants, name) for name in SETTINGS}
+    overrides = load_settings(settings_path)
+    if "TEST_MODE" in overrides and "FINISH_ORDER" not in overrides:
+        overrides["FINISH_ORDER"] = not overrides["TEST_MODE"]
+    settings.update(overrides)
+    with open(data_path) as f:
+        data = json.load(f)["data"]
+    try:
+        items = data["test_items_data"] if settings["TEST_MODE"] else data["fumo_items_data"]
+        item_jsons = generate_item_jsons_pre_order(data["base_request_data"], items)
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Missing item data in {data_path}: {e!r}")
+    return RuntimeConfig(**{name.lower(): SETTINGS[name](value) for name, value in settings.items()},
+                         item_jsons=tuple(item_jsons), item_jsons_check_info=tuple(generate_item_jsons_check_info(items)), version=version)
+
+
+_current: Optional[RuntimeConfig] = None
+
+
+def current_config() -> RuntimeConfig:
+    """
+    :return: The configuration in effect. Read it again for every decision rather than keeping it around, so that reloads are picked up.
+    """
+    global _current
+    if _current is None:
+        _current = load_runtime_config()
+    return _current
+
+
+def set_config(config: RuntimeConfig):
+    """
+    Swaps in a new configuration. Usually done by ConfigWatcher.
+    """
+    global _current
+    _current = config
+
+
+class ConfigWatcher:
+    """
+    Reloads the configuration whenever fumo_data.json or the settings file changes, from a background thread.
+    A broken file leaves the current configuration in place, so that a half saved edit can't take down a running session.
+    """
+
+    def __init__(self, data_path=FUMO_DATA_PATH, settings_path=SETTINGS_PATH, poll_s=CONFIG_POLL_S):
+        """
+        :param poll_s: Time between two checks of the files' modification times.
+        """
+        self.data_path = data_path
+        self.settings_path = settings_path
+        self.poll_s = poll_s
+        self._listeners: List[Callable[[RuntimeConfig, RuntimeConfig], None]] = []
+        self._mtimes = self._read_mtimes()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, listener: Callable[[RuntimeConfig, RuntimeConfig], None]):
+        """
+        :param listener: Called as listener(old, new) after every reload, from the watcher's thread. Reloads wait on it, keep it short.
+                         Whatever it raises is reported and doesn't keep the other listeners from running.
+        """
+        self._listeners = self._listeners + [listener]
+
+    def unsubscribe(self, listener):
+        self._listeners = [existing for existing in self._listeners if existing is not listener]
+
+    def _read_mtimes(self) -> Tuple[Optional[float], ...]:
+        mtimes = []
+        for path in (self.data_path, self.settings_path):
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def check(self) -> bool:
+        """
+        Reloads the configuration if any of the files changed since the last check.
+        :return: Whether a new configuration is in effect.
+        """
+        mtimes = self._read_mtimes()
+        if mtimes == self._mtimes:
+            return False
+        changed = [mtime for mtime, previous in zip(mtimes, self._mtimes) if mtime != previous]
+        self._mtimes = mtimes
+        return self.reload(time() if None in changed else max(changed))  # a deleted file doesn't say when it went away
+
+    def reload(self, changed_at=None) -> bool:
+        """
+        Loads the files, swaps in the new configuration and lets the listeners know.
+        The time from the file change to the last listener is recorded under config.reload_latency.
+        :param changed_at: time() at which the files changed, now by default.
+        :return: Whether a new configuration is in effect.
+        """
+        changed_at = time() if changed_at is None else changed_at
+        start = perf_counter()
+        old = current_config()
+        try:
+            new = load_runtime_config(self.data_path, self.settings_path, old.version + 1)
+        except (OSError, ValueError) as e:
+            metrics.count("config.reload_errors")
+            print(f"Config reload failed, keeping version {old.version}: {e}")
+            return False
+        set_config(new)
+        for listener in self._listeners:
+            try:
+                listener(old, new)
+            except Exception as e:  # the new config is in effect either way, and the watcher has to survive to pick up the next fix.
+                metrics.count("config.listener_errors")
+                print(f"Config listener {getattr(listener, '__qualname__', listener)} failed on version {new.version}: {e!r}")
+        metrics.record("config.reload", perf_counter() - start)
+        latency = time() - changed_at
+        metrics.record("config.reload_latency", latency)
+        changed = [field for field in RuntimeConfig._fields if field != "version" and getattr(old, field) != getattr(new, field)]
+        print(f"Config version {new.version} in effect {latency * 1000:.0f}ms after the change: {', '.join(changed) or 'nothing changed'}")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.poll_s):
+            self.check()
+
+    def start(self):
+        """
+        Starts watching in the background.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
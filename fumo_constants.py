@@ -1,81 +1,158 @@
-import json
-
-import secrets
-
-# # configs
-TEST_MODE = True
-TEST_API_AVAILABILITY = False  # polls the API and logs the results. the idea is to check how often each VM can get requests through.
-CART_ONLY_MODE = False  # Consider the current situation. it might be so slow that only the API Requests to add things to cart will be able to get through.
-FINISH_ORDER = not TEST_MODE  # since if we're testing, we don't want to order, and vice versa.
-DHL = True
-ORDER_ALL_AT_ONCE = False
-
-RELOAD_SESSION = True  # Keep chrome session
-SHOULD_AUTOLOGIN = False  # parameter which decides wether or not we need to log in
-WAIT_FOR_ITEMS = True  # can be set to false if the orders have already started, which I recommend doing.
-WAIT_FOR_ITEMS_STOP_ON_OVERLOAD = True
-WAIT_FOR_USER1 = False
-
-# # regular constants
-
-LOOP_WAIT_TIME_MS = 250  # higher wait is necessary for JP.
-REQUESTOR_WAIT_MS = 600  # based on whether we expect them to get angry at too many requests, we might want to set to 0 for maximum performance.
-WAIT_TIME_AFTER_SUCCESS = 5  # how long to wait after successfully adding a fumo to cart, before force quitting all instances.
-USERNAME = secrets.username
-PASSWORD = secrets.password
-
-# Card details, all strings except the type:
-CARD_OWNER = secrets.card_owner
-CARD_TYPE = secrets.card_type  # Visa is 0, mastercard is 1
-CARD_NUMBER = secrets.card_number
-SECURITY_CODE = secrets.security_code
-EXP_YEAR = secrets.expiration_year  # full date
-EXP_MONTH = secrets.expiration_month  # no leading 0
-
-CART_TYPE_CLOSED = 2  # pre-orders closed
-CART_TYPE_SOON = 5  # available to order soon
-CART_TYPE_ON_SALE_PRE = 8  # pre-order
-
-# not currently relevant, but generally good to know
-# 3, 4, 6 are all "closed" for various reasons I guess
-CART_TYPE_UNAVAILABLE = 1  # unavailable, go figure what this means.
-CART_TYPE_ON_SALE_BACK = 7  # back-order
-CART_TYPE_ON_SALE_NO_PRE = 9  # not a pre-order, direct buy
-
-STATUS_SUCCESS = 200
-STATUS_UNAVAILABLE = 400
-STATUS_TROTTLED = 429
-STATUS_TOO_MUCH_TRAFFIC = 503
-
-# Errors:
-ERR_NONE = 0
-ERR_OVERLOAD = 1
-ERR_CART = 2
-
-# various
-LOG_TO_FILE_FREQUENCY = 25
-
-# URLs
-USER_INFO_URL = "https://secure.test.com/"  # User information page, which is expected to automatically prompt if not currently logged in.
-CART_PAGE_URL = "https://www.test.com/cart/"
-CART_CHECKOUT_URL = "https://secure.test.com/checkoutcart/"
-API_GET_ITEM_INFO_URL = "https://api.test.com/api/v1.0/item"
-API_CART_URL = "https://api.test.com/api/v1.0/cart"
-
-with open("./fumo_data.json") as fumo_data:
-    fumo_data = json.load(fumo_data)["data"]
-    headers = fumo_data["headers"]  # The relevant headers for the API requests
-
-    base_request_data = fumo_data["base_request_data"]  # stores the session parameters, used in and required for the API requests
-
-    
-    item_json_cart_setup = {  # item added to cart, and then removed. used to pre-generate the current session's cart ID.
-        **base_request_data,
-        **fumo_data
-    }
-
-    # This data is the one we iterate over when looking for an in stock item, and then we order everything in the list
-    # max_cartin_count is just the buy limit
-    # DESC param is the sname
-    items_data_fumo = fumo_data["fumo_items_data"]
-    items_test_data = fumo_data["test_items_data"]
+import json
+import os
+
+import secrets
+
+# # configs
+TEST_MODE = True
+TEST_API_AVAILABILITY = False  # polls the API and logs the results. the idea is to check how often each VM can get requests through.
+CART_ONLY_MODE = False  # Consider the current situation. it might be so slow that only the API Requests to add things to cart will be able to get through.
+FINISH_ORDER = not TEST_MODE  # since if we're testing, we don't want to order, and vice versa.
+DHL = True
+ORDER_ALL_AT_ONCE = False
+
+RELOAD_SESSION = True  # Keep chrome session
+USE_SESSION_SNAPSHOT = True  # save the API session after the browser setup, and start straight from it on the next run. the browser is then only launched for the checkout.
+SESSION_SNAPSHOT_PATH = "session_snapshot.json"
+SESSION_SNAPSHOT_MAX_AGE_S = 6 * 60 * 60
+BROWSER_DEBUGGER_ADDRESS = None  # e.g. "127.0.0.1:9222" to attach to an already running, logged in Chrome, or launch one which survives restarts.
+RESOURCE_BLOCK_PROFILE = "checkout"  # which of RESOURCE_BLOCK_PROFILES the browser uses, "none" loads everything.
+RESOURCE_REPORT = False  # collect requests and bytes per checkout page from chrome's performance log, written to resource_report_<profile>.json
+CHECKOUT_WORKER_ADDRESS = ("127.0.0.1", 6001)  # where the checkout worker listens for the stock monitor, when they run as separate processes. see fumo_processes.
+CHECKOUT_WORKER_AUTHKEY = os.environ.get("FUMO_CHECKOUT_WORKER_AUTHKEY", "").encode()  # the worker's secret. supervise makes up its own, set it to run the processes separately.
+SHOULD_AUTOLOGIN = False  # parameter which decides wether or not we need to log in
+WAIT_FOR_ITEMS = True  # can be set to false if the orders have already started, which I recommend doing.
+WAIT_FOR_ITEMS_STOP_ON_OVERLOAD = True
+PIPELINED_CART = True  # with WAIT_FOR_ITEMS, cart every item the moment it's detected instead of waiting for the first one and then carting them all.
+WAIT_FOR_USER1 = False
+HOT_RELOAD_CONFIG = True  # pick up changes to fumo_data.json and fumo_settings.json while running, see fumo_config.
+
+# # regular constants
+
+LOOP_WAIT_TIME_MS = 250  # higher wait is necessary for JP.
+REQUESTOR_WAIT_MS = 600  # minimal time between two cart requests for the same item. the overall rate is up to the governor below.
+WAIT_TIME_AFTER_SUCCESS = 5  # after successfully adding a fumo to cart, the others are force quit once the cart API confirms it, or after this long at most.
+CART_WORKERS = 10  # cart-add worker threads, started once per requests session. the session keeps as many pooled connections.
+API_REQUEST_TIMEOUT_S = 10  # a request which hasn't been answered by then is given up on and retried, rather than holding up its worker.
+PREWARM_CONNECTIONS = True  # open the API connections ahead of time and keep them alive, so the first cart request doesn't pay for the handshakes.
+KEEPALIVE_INTERVAL_S = 15  # time between keep-alive rounds, each round is a single OPTIONS request per pooled connection.
+# client side rate limit shared by every API request: the stock monitor, the cart workers and the availability poller. see fumo_governor.
+API_RATE_PER_SECOND = 1000 / LOOP_WAIT_TIME_MS  # starting rate, the same pace as the polling always had
+API_RATE_MIN_PER_SECOND = 0.5
+API_RATE_MAX_PER_SECOND = API_RATE_PER_SECOND  # the governor only ever recovers back to the starting rate. anything faster just asks for a 429.
+API_BURST = CART_WORKERS  # so that the first request of every cart worker goes out at once
+API_RATE_DECREASE = 0.5  # the rate is multiplied by this on a 429 or 503, honoring Retry-After on top of it
+API_RATE_INCREASE = 0.5  # and grows back by this many requests per second, for each second of successful (2xx/3xx) responses
+MONITOR_CONNECTIONS_PER_HOST = 1  # pooled connections the stock monitor keeps open per host. raise it if the round trip is longer than the budget interval.
+USERNAME = secrets.username
+PASSWORD = secrets.password
+
+# Card details, all strings except the type:
+CARD_OWNER = secrets.card_owner
+CARD_TYPE = secrets.card_type  # Visa is 0, mastercard is 1
+CARD_NUMBER = secrets.card_number
+SECURITY_CODE = secrets.security_code
+EXP_YEAR = secrets.expiration_year  # full date
+EXP_MONTH = secrets.expiration_month  # no leading 0
+
+CART_TYPE_CLOSED = 2  # pre-orders closed
+CART_TYPE_SOON = 5  # available to order soon
+CART_TYPE_ON_SALE_PRE = 8  # pre-order
+
+# not currently relevant, but generally good to know
+# 3, 4, 6 are all "closed" for various reasons I guess
+CART_TYPES_CLOSED = (CART_TYPE_CLOSED, 3, 4, 6)
+CART_TYPE_UNAVAILABLE = 1  # unavailable, go figure what this means.
+CART_TYPE_ON_SALE_BACK = 7  # back-order
+CART_TYPE_ON_SALE_NO_PRE = 9  # not a pre-order, direct buy
+CART_TYPES_PURCHASABLE = (CART_TYPE_ON_SALE_PRE, CART_TYPE_ON_SALE_NO_PRE, CART_TYPE_ON_SALE_BACK)
+
+# minimum time between two polls of the same item, by the cart_type it last reported. the monitor's request budget still caps the total,
+# so items about to drop get most of it, and items which are closed for now cost less.
+# an item can go from closed to on sale directly, or skip through "soon" in no time, so every interval here is also how late such a restock
+# can be seen at worst. keep them to a few polls of the budget.
+POLL_INTERVALS_S = {
+    CART_TYPE_SOON: 0,
+    **{cart_type: 1 for cart_type in CART_TYPES_CLOSED},
+    CART_TYPE_UNAVAILABLE: 2,
+}
+POLL_INTERVAL_DEFAULT_S = 0  # items which didn't answer yet, or reported a cart_type not listed above
+
+STATUS_NO_RESPONSE = 0  # logged in place of a status code when the request failed altogether, e.g. a dropped connection or a timeout
+STATUS_SUCCESS = 200
+STATUS_NOT_MODIFIED = 304  # answer to a conditional request, the item didn't change since the last poll
+STATUS_UNAVAILABLE = 400
+STATUS_TROTTLED = 429
+STATUS_TOO_MUCH_TRAFFIC = 503
+
+# various
+DOM_WAIT_MODE = "observer"  # "observer" waits for checkout elements with a MutationObserver in one round trip, "poll" checks every DOM_WAIT_POLL_S instead.
+DOM_WAIT_POLL_S = 0.05
+DOM_WAIT_TIMEOUT_S = 30
+READY_POLL_S = 0.05  # how often readiness conditions which can't be waited on directly (e.g. cookies) are checked
+CART_CONFIRM_POLL_S = 0.25  # minimum time between two reads of the cart API when confirming an addition, which we don't want to hammer
+CART_CONFIRM_READS = 2  # reads of the cart API to confirm an addition, the rest of WAIT_TIME_AFTER_SUCCESS is waited out without asking again
+MONITOR_STOP_POLL_S = 0.05  # how often the stock monitor checks whether the cart round was stopped, e.g. because an item made it to the cart
+CART_READ_ATTEMPTS = 3  # reads of the cart after a checkout before giving up on knowing whether it went through
+CART_STATE_MAX_AGE_S = 2  # cart contents read from the API are reused for this long before being read again
+BATCHED_FORM_FILL = True  # fill the whole payment & shipping step in one script execution, falls back to element by element if that fails.
+# backoff of each checkout step after an error, as (first wait in seconds, multiplier per further failure, max wait). "load" is the checkout page itself.
+# after an error the checkout page is loaded again, and picks up from whichever step the site says we're at.
+CHECKOUT_RETRY_POLICIES = {
+    "load": (0.5, 2, 5),
+    "login": (0.5, 2, 5),
+    "step_1": (0.2, 1.5, 3),
+    "step_2": (0.2, 1.5, 3),
+    "step_3": (0.1, 1.5, 2),  # the closest to done, and the most contested. come back fast.
+}
+CHECKOUT_ATTEMPTS = 3  # whole checkouts tried in a row while the cart still holds what we checked out, when FINISH_ORDER is on
+LOG_TO_FILE_FREQUENCY = 25  # the request log is flushed to disk every this many requests
+REQUEST_LOG_PATH = "requests_results.csv"
+REQUEST_LOG_MAX_BYTES = 10_000_000  # the request log is rotated past this size
+REQUEST_LOG_BACKUPS = 5
+CHECKOUT_WORKER_CONNECT_TIMEOUT_S = 180  # how long the monitor waits for the checkout worker to (re)start, which includes a browser launch and login.
+CHECKOUT_PARK_REFRESH_S = 60  # the parked checkout page is reloaded when it's older than this, on an in stock event or when idle.
+CONFIG_POLL_S = 0.5  # how often the config files are checked for changes
+PROCESS_RESTART_DELAY_S = 2  # the supervisor waits this long before restarting a process which died.
+METRICS_REPORT_BASENAME = "run_metrics"  # the latency histograms of each run are written to run_metrics.json and run_metrics.csv
+
+# URL patterns the browser doesn't even request, through Network.setBlockedURLs. "*" matches anything.
+# the checkout only needs the documents, scripts and XHRs, so images, fonts, media and trackers go.
+RESOURCE_BLOCK_PROFILES = {
+    "none": [],
+    "checkout": [
+        "*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.svg*", "*.ico*",
+        "*.woff*", "*.ttf*", "*.otf*", "*.eot*",
+        "*.mp4*", "*.webm*", "*.mp3*",
+        "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*facebook.net*", "*facebook.com/tr*", "*twitter.com/i/adsct*",
+    ],
+}
+
+# URLs, each of them can be overridden through an environment variable of the same name prefixed with FUMO_, e.g. to point everything at fumo_mock_shop.
+USER_INFO_URL = os.environ.get("FUMO_USER_INFO_URL", "https://secure.test.com/")  # User information page, which is expected to automatically prompt if not currently logged in.
+CART_PAGE_URL = os.environ.get("FUMO_CART_PAGE_URL", "https://www.test.com/cart/")
+CART_CHECKOUT_URL = os.environ.get("FUMO_CART_CHECKOUT_URL", "https://secure.test.com/checkoutcart/")
+API_GET_ITEM_INFO_URL = os.environ.get("FUMO_API_GET_ITEM_INFO_URL", "https://api.test.com/api/v1.0/item")
+API_CART_URL = os.environ.get("FUMO_API_CART_URL", "https://api.test.com/api/v1.0/cart")
+
+FUMO_DATA_PATH = os.environ.get("FUMO_DATA_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fumo_data.json"))
+# overrides of the settings which can change while running (TEST_MODE, DHL, the timings...), by name. see fumo_config.SETTINGS
+SETTINGS_PATH = os.environ.get("FUMO_SETTINGS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fumo_settings.json"))
+
+with open(FUMO_DATA_PATH) as fumo_data:
+    fumo_data = json.load(fumo_data)["data"]
+    headers = fumo_data["headers"]  # The relevant headers for the API requests
+
+    base_request_data = fumo_data["base_request_data"]  # base of the API request payloads. the session tokens themselves live in FumoCarter.tokens
+
+    
+    item_json_cart_setup = {  # item added to cart, and then removed. used to pre-generate the current session's cart ID.
+        **base_request_data,
+        **fumo_data
+    }
+
+    # This data is the one we iterate over when looking for an in stock item, and then we order everything in the list
+    # max_cartin_count is just the buy limit
+    # DESC param is the sname
+    items_data_fumo = fumo_data["fumo_items_data"]
+    items_test_data = fumo_data["test_items_data"]
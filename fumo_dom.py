@@ -0,0 +1,192 @@
+from time import monotonic, sleep
+from typing import List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from selenium.common.exceptions import JavascriptException, TimeoutException, WebDriverException
+
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webelement import WebElement
+
+
+class By:
+    """
+    Same values as selenium.webdriver.common.by.By, which can't be imported without pulling in the whole of selenium.webdriver.
+    """
+    ID = "id"
+    XPATH = "xpath"
+    NAME = "name"
+    TAG_NAME = "tag name"
+    CLASS_NAME = "class name"
+    CSS_SELECTOR = "css selector"
+
+
+# Finds the first of the locators present in the page. Each locator is [kind, selector, report_selector], where kind is "css" or "xpath",
+# and report_selector optionally points at another element to return instead, e.g. the title of an alert rather than its text.
+# Returns [index, element, element text], or null if none of them are there.
+_FIND_FIRST_JS = """
+function fumoFind(kind, selector) {
+    if (kind === 'xpath') {
+        return document.evaluate(selector, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    }
+    return document.querySelector(selector);
+}
+function fumoFindFirst(locators) {
+    for (var i = 0; i < locators.length; i++) {
+        var elem = fumoFind(locators[i][0], locators[i][1]);
+        if (elem) {
+            if (locators[i][2]) {
+                elem = fumoFind('css', locators[i][2]) || elem;
+            }
+            return [i, elem, (elem.innerText || elem.textContent || '').trim()];
+        }
+    }
+    return null;
+}
+"""
+
+# Resolves as soon as any of the locators appears, using a MutationObserver rather than polling from the outside.
+_WAIT_FOR_ANY_JS = _FIND_FIRST_JS + """
+var locators = arguments[0], timeout = arguments[1], done = arguments[arguments.length - 1];
+var found = fumoFindFirst(locators);
+if (found) {
+    done(found);
+} else {
+    var timer = null;
+    var observer = new MutationObserver(function () {
+        var found = fumoFindFirst(locators);
+        if (found) {
+            observer.disconnect();
+            clearTimeout(timer);
+            done(found);
+        }
+    });
+    observer.observe(document, {childList: true, subtree: true, characterData: true});
+    timer = setTimeout(function () { observer.disconnect(); done(null); }, timeout);
+}
+"""
+
+_FIND_NOW_JS = _FIND_FIRST_JS + "return fumoFindFirst(arguments[0]);"
+
+# Runs a list of form actions in order, in a single script execution. Values are set through the native setters, followed by the
+# input and change events the page's framework listens to. A "wait" action pauses until its locator appears (or times out), for
+# fields which only get rendered after an earlier click. Returns whether each action succeeded.
+_FORM_ACTIONS_JS = _FIND_FIRST_JS + """
+var actions = arguments[0], done = arguments[arguments.length - 1];
+var results = [];
+function setValue(elem, proto, value) {
+    Object.getOwnPropertyDescriptor(proto, 'value').set.call(elem, value);
+    elem.dispatchEvent(new Event('input', {bubbles: true}));
+    elem.dispatchEvent(new Event('change', {bubbles: true}));
+}
+function apply(action, elem) {
+    if (action[0] === 'click') {
+        elem.click();
+    } else if (action[0] === 'value') {
+        elem.focus();
+        setValue(elem, HTMLInputElement.prototype, action[2]);
+        elem.blur();
+    } else if (action[0] === 'select_index') {
+        if (action[2] >= elem.options.length) return false;
+        setValue(elem, HTMLSelectElement.prototype, elem.options[action[2]].value);
+    } else if (action[0] === 'select_value') {
+        var values = Array.prototype.map.call(elem.options, function (o) { return o.value; });
+        if (values.indexOf(String(action[2])) < 0) return false;
+        setValue(elem, HTMLSelectElement.prototype, String(action[2]));
+    }
+    return true;
+}
+function run(i) {
+    if (i >= actions.length) {
+        done(results);
+        return;
+    }
+    var action = actions[i];
+    var elem = fumoFind(action[1][0], action[1][1]);
+    if (action[0] === 'wait') {
+        var waited = 0;
+        (function poll() {
+            var elem = fumoFind(action[1][0], action[1][1]);
+            if (elem || waited >= action[2]) {
+                results.push(!!elem);
+                run(i + 1);
+            } else {
+                waited += 20;
+                setTimeout(poll, 20);
+            }
+        })();
+        return;
+    }
+    try {
+        results.push(elem ? apply(action, elem) : false);
+    } catch (e) {
+        results.push(false);
+    }
+    run(i + 1);
+}
+run(0);
+"""
+
+# Selenium locator strategies as CSS selectors, XPaths are handled separately.
+_CSS_FORMATS = {
+    By.CLASS_NAME: ".{}",
+    By.ID: "#{}",
+    By.NAME: '[name="{}"]',
+    By.TAG_NAME: "{}",
+    By.CSS_SELECTOR: "{}",
+}
+
+
+def to_js_locator(by, value, report_class=None) -> List:
+    """
+    Converts a selenium (by, value) locator to the format used by the wait scripts.
+    :param report_class: Class name of an element to return instead of the matched one, if present.
+    """
+    report = f".{report_class}" if report_class else None
+    if by == By.XPATH:
+        return ["xpath", value, report]
+    return ["css", _CSS_FORMATS[by].format(value), report]
+
+
+def wait_for_any(driver, locators: Sequence[List], timeout_s=30, mode="observer", poll_s=0.05) -> Tuple[int, "WebElement", str]:
+    """
+    Waits until any of the locators is present.
+    :param locators: Locators as returned by to_js_locator, in order of priority.
+    :param timeout_s: Time after which a TimeoutException is raised, same as WebDriverWait.
+    :param mode: "observer" resolves in a single round trip through a MutationObserver, "poll" checks every poll_s seconds.
+    :return: (index of the matched locator, matched element, its text)
+    """
+    deadline = monotonic() + timeout_s
+    while True:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise TimeoutException(f"None of {[locator[1] for locator in locators]} appeared within {timeout_s}s")
+        try:
+            if mode == "observer":
+                found = driver.execute_async_script(_WAIT_FOR_ANY_JS, list(locators), int(remaining * 1000))
+            else:
+                found = driver.execute_script(_FIND_NOW_JS, list(locators))
+        except (JavascriptException, WebDriverException):  # the page navigated away under the script, just go again on the new one.
+            found = None
+            sleep(poll_s)
+        if found:
+            return found[0], found[1], found[2]
+        if mode != "observer":
+            sleep(poll_s)
+
+
+def find_now(driver, locators: Sequence[List]) -> Optional[Tuple[int, "WebElement", str]]:
+    """
+    Single round trip check of which of the locators is currently present, without waiting.
+    :return: (index of the matched locator, matched element, its text), or None
+    """
+    found = driver.execute_script(_FIND_NOW_JS, list(locators))
+    return (found[0], found[1], found[2]) if found else None
+
+
+def run_form_actions(driver, actions: Sequence[List]) -> List[bool]:
+    """
+    Fills in a form in a single round trip.
+    :param actions: List of [kind, js locator, argument], kind being one of "click", "value", "select_index", "select_value" or "wait".
+                    The argument of "wait" is its timeout in milliseconds.
+    :return: Whether each of the actions succeeded, in order.
+    """
+    return driver.execute_async_script(_FORM_ACTIONS_JS, list(actions))
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep, time
+from typing import Optional
+
+from fumo_constants import *
+from fumo_metrics import metrics
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """
+    :param value: Value of a Retry-After header, either a number of seconds or an HTTP date.
+    :return: Seconds to wait, None if there is no usable value.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateGovernor:
+    """
+    Client side rate limit shared by every API request of the run: the stock monitor, the cart workers and the availability poller.
+    A token bucket (in its GCRA form, which needs no refill thread) lets bursts of up to `burst` requests through, e.g. every cart worker's
+    first request, and paces the rest at the current rate.
+    The rate adapts to the server: 429 and 503 answers cut it, Retry-After pauses everything until then, and successes slowly raise it back,
+    up to max_rate.
+    """
+
+    def __init__(self, rate=API_RATE_PER_SECOND, burst=API_BURST, min_rate=API_RATE_MIN_PER_SECOND, max_rate=API_RATE_MAX_PER_SECOND,
+                 decrease=API_RATE_DECREASE, increase=API_RATE_INCREASE, clock=monotonic, verbose=True):
+        """
+        :param rate: Starting rate, in requests per second.
+        :param burst: Amount of requests which can go out back to back after an idle period.
+        :param min_rate: The rate is never cut below this.
+        :param max_rate: The rate is never raised above this.
+        :param decrease: Factor the rate is multiplied by on a 429 or 503.
+        :param increase: Requests per second the rate grows by, over each second's worth of successful responses.
+        :param clock: Source of the current time, in seconds. Only ever replaced by the simulator, which runs on its own clock.
+        :param verbose: Print the rate cuts.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.decrease = decrease
+        self.increase = increase
+        self.clock = clock
+        self.verbose = verbose
+        self._tat = 0.0  # theoretical arrival time of the next request, on self.clock
+        self._blocked_until = 0.0  # set from Retry-After
+        self._last_cut = 0.0
+        self._lock = threading.Lock()  # held for a few arithmetic operations only, fine to take from the event loop too.
+
+    def reserve(self) -> float:
+        """
+        Reserves the next request slot, without waiting for it.
+        :return: Time until the slot, 0 if the request can go out right away.
+        """
+        with self._lock:
+            now = self.clock()
+            interval = 1 / self.rate
+            start = max(now, self._blocked_until)
+            slot = max(start, self._tat - (self.burst - 1) * interval)
+            self._tat = max(self._tat, slot) + interval
+        return slot - now
+
+    def hold_remaining(self) -> float:
+        """
+        :return: Time until the last Retry-After is over, 0 if there is none in effect.
+        """
+        with self._lock:
+            return max(0.0, self._blocked_until - self.clock())
+
+    def acquire(self, cancelled: Optional[threading.Event] = None) -> bool:
+        """
+        Blocks until the request may be sent.
+        :param cancelled: Event which interrupts the wait when set.
+        :return: False if the wait was interrupted by cancelled, or if it was already set, in which case no slot is taken.
+        """
+        if cancelled is not None and cancelled.is_set():
+            return False
+        delay = self.reserve()
+        if delay <= 0:
+            return True
+        with metrics.timed("sleep.governor"):
+            if cancelled is not None:
+                return not cancelled.wait(delay)
+            sleep(delay)
+        return True
+
+    async def acquire_async(self):
+        """
+        Same as acquire, for the event loop.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            with metrics.timed("sleep.governor"):
+                await asyncio.sleep(delay)
+
+    def reset_rate(self, rate, max_rate):
+        """
+        Starts over from a new rate, e.g. after LOOP_WAIT_TIME_MS was changed while running.
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, rate)
+            self.max_rate = max_rate
+
+    def on_response(self, status, retry_after=None):
+        """
+        Adapts the rate to a response.
+        :param status: HTTP status code
+        :param retry_after: Value of the Retry-After header, if any.
+        """
+        if status in (STATUS_TROTTLED, STATUS_TOO_MUCH_TRAFFIC):
+            metrics.count(f"governor.status_{status}")
+            wait = parse_retry_after(retry_after)
+            with self._lock:
+                now = self.clock()
+                if wait is not None:
+                    self._blocked_until = max(self._blocked_until, now + wait)
+                # every request in flight comes back with the same news, only cut once per round of them.
+                cut = now - self._last_cut >= 1 / self.rate
+                if cut:
+                    self._last_cut = now
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+            if cut:
+                metrics.count("governor.rate_cuts")
+            if cut and self.verbose:
+                print(f"Rate cut to {self.rate:.2f} requests/s" + (f", holding off for {wait:.1f}s" if wait else ""))
+        elif status < 400:  # anything else, like the 400 of an item not on sale, is no sign that the server could take more.
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
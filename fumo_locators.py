@@ -0,0 +1,75 @@
+from typing import Dict, Iterable, Optional
+
+from fumo_dom import By, to_js_locator
+
+# Every element the login and checkout flow interacts with, in a single place. (by, value) pairs, as taken by find_element.
+_STEP_2 = '//*[@id="__layout"]/div/div/div/div/div[2]'
+_PAYMENT = _STEP_2 + '/section[2]/div/div[2]'
+LOCATORS = {
+    # login
+    "login_email": (By.NAME, 'email'),
+    "login_password": (By.NAME, 'password'),
+    "submit": (By.CLASS_NAME, 'btn-submit'),
+    "account_ready": (By.CLASS_NAME, 'search-box__button'),
+    "cart_page_title": (By.XPATH, '//*[@id="__layout"]/div/div[1]/div[2]/div/div/div[1]/section/h2'),
+    # errors
+    "alert_text": (By.CLASS_NAME, 'alert-area__text'),
+    "alert_title": (By.CLASS_NAME, 'alert-area__title'),
+    "error_title": (By.CLASS_NAME, 'item-detail__error-title'),
+    "back": (By.CLASS_NAME, 'btn-back'),
+    # step 1, rearrangement options
+    "step_1_return": (By.XPATH, "//button[text()='Return']"),
+    # step 2, payment & shipping
+    "step_2_radio": (By.CLASS_NAME, 'form-radio'),
+    "payment_card": (By.XPATH, _PAYMENT + '/div/label'),
+    "card_number": (By.XPATH, _PAYMENT + '/div[2]/div[2]/input'),
+    "card_owner": (By.XPATH, _PAYMENT + '/div[2]/div[4]/input'),
+    "security_code": (By.XPATH, _PAYMENT + '/div[2]/div[5]/input'),
+    "card_type": (By.XPATH, '//*[@id="selectCardType"]'),
+    "exp_year": (By.XPATH, _PAYMENT + '/div[2]/div[3]/div[1]/select'),
+    "exp_month": (By.XPATH, _PAYMENT + '/div[2]/div[3]/div[2]/select'),
+    "shipping_dhl": (By.XPATH, _STEP_2 + '/section[3]/div[2]/div[1]/span/label'),
+    "shipping_surface": (By.XPATH, _STEP_2 + '/section[3]/div[2]/div[2]/span/label'),
+    # step 3, confirmation
+    "place_order": (By.XPATH, _STEP_2 + '/section/div[3]/form/button'),
+    "order_complete": (By.CLASS_NAME, 'order-complete__title'),
+}
+
+STEP_2_LOCATORS = ("step_2_radio", "payment_card", "card_number", "card_owner", "security_code", "card_type", "exp_year", "exp_month", "shipping_dhl", "shipping_surface", "submit")
+
+# Reports which of the locators are present, in a single round trip.
+_CHECK_JS = """
+var result = {};
+var locators = arguments[0];
+for (var name in locators) {
+    var l = locators[name];
+    result[name] = !!(l[0] === 'xpath'
+        ? document.evaluate(l[1], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue
+        : document.querySelector(l[1]));
+}
+return result;
+"""
+
+
+def js_locator(name, report_class=None):
+    """
+    :return: The named locator in the format used by the fumo_dom scripts.
+    """
+    return to_js_locator(*LOCATORS[name], report_class=report_class)
+
+
+def check_locators(driver, names: Optional[Iterable[str]] = None) -> Dict[str, bool]:
+    """
+    Checks the locators against the current page, all of them in one script execution.
+    :param names: Names of the locators to check, all of them by default.
+    :return: Whether each locator is present.
+    """
+    names = LOCATORS.keys() if names is None else names
+    return driver.execute_script(_CHECK_JS, {name: js_locator(name) for name in names})
+
+
+def error_locators() -> list:
+    """
+    :return: The locators of the site's error pages, in the format used by the fumo_dom scripts. The alert is told apart by its title.
+    """
+    return [js_locator("alert_text", report_class=LOCATORS["alert_title"][1]), js_locator("error_title")]
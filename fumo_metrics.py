@@ -0,0 +1,160 @@
+import csv
+import json
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict
+
+# Upper bounds of the histogram buckets, in milliseconds. Anything slower ends up in the last, unbounded bucket.
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram. Recording is a bisect and a few additions, cheap enough to leave on all the time.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.buckets[bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, p) -> float:
+        """
+        :param p: Percentile between 0 and 100
+        :return: Upper bound, in seconds, of the bucket the percentile falls in. Capped by the largest recorded value.
+        """
+        if not self.count:
+            return 0.0
+        target = p / 100 * self.count
+        seen = 0
+        for i, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target and bucket:
+                if i == len(BUCKET_BOUNDS_MS):
+                    return self.max
+                return min(BUCKET_BOUNDS_MS[i] / 1000, self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_s": self.total,
+            "mean_s": self.total / self.count if self.count else 0.0,
+            "min_s": self.min,
+            "p50_s": self.percentile(50),
+            "p90_s": self.percentile(90),
+            "p99_s": self.percentile(99),
+            "max_s": self.max,
+            "buckets_ms": {str(bound): count for bound, count in zip(BUCKET_BOUNDS_MS + ("inf",), self.buckets)},
+        }
+
+
+class Metrics:
+    """
+    Collection of latency histograms, one per phase of the run, plus a few plain counters for what isn't a duration (e.g. bytes).
+    """
+
+    def __init__(self):
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds):
+        """
+        Adds a single timing to the histogram of the phase.
+        """
+        with self._lock:
+            histogram = self._histograms.get(phase)
+            if histogram is None:
+                histogram = self._histograms[phase] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def count(self, name, amount=1):
+        """
+        Adds to the counter of the given name.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def counters(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    @contextmanager
+    def timed(self, phase):
+        """
+        Times the enclosed block. Can also be used as a decorator.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {phase: histogram.as_dict() for phase, histogram in sorted(self._histograms.items())}
+
+    def sleep_budget(self) -> Dict[str, float]:
+        """
+        :return: Total time spent in deliberate sleeps (sleep.* phases), against the time spent waiting on readiness conditions (ready.* phases).
+        """
+        snapshot = self.snapshot()
+        return {"sleeping_s": sum(h["total_s"] for phase, h in snapshot.items() if phase.startswith("sleep.")),
+                "ready_s": sum(h["total_s"] for phase, h in snapshot.items() if phase.startswith("ready."))}
+
+    def summary(self) -> str:
+        """
+        :return: Human readable table of all the phases.
+        """
+        lines = [f"{'phase':<32}{'count':>7}{'total':>10}{'mean':>9}{'p50':>9}{'p90':>9}{'max':>9}"]
+        for phase, h in self.snapshot().items():
+            lines.append(f"{phase:<32}{h['count']:>7}{h['total_s']:>10.3f}{h['mean_s']:>9.3f}{h['p50_s']:>9.3f}{h['p90_s']:>9.3f}{h['max_s']:>9.3f}")
+        budget = self.sleep_budget()
+        lines.append(f"\nsleep budget: {budget['sleeping_s']:.3f}s sleeping, {budget['ready_s']:.3f}s waiting on readiness conditions")
+        counters = self.counters()
+        if counters:
+            lines.append(f"\n{'counter':<32}{'value':>12}")
+            lines.extend(f"{name:<32}{value:>12g}" for name, value in counters.items())
+        return "\n".join(lines)
+
+    def export_json(self, path):
+        """
+        The histograms of every phase, with the counters and the sleep budget under keys of their own.
+        """
+        with open(path, "w") as f:
+            json.dump({**self.snapshot(), "counters": self.counters(), "sleep_budget": self.sleep_budget()}, f, indent=2)
+
+    def export_csv(self, path):
+        """
+        One row per phase, with the bucket counts as the last columns.
+        """
+        snapshot = self.snapshot()
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["phase", "count", "total_s", "mean_s", "min_s", "p50_s", "p90_s", "p99_s", "max_s"] + [f"le_{bound}ms" for bound in BUCKET_BOUNDS_MS + ("inf",)])
+            for phase, h in snapshot.items():
+                writer.writerow([phase, h["count"], h["total_s"], h["mean_s"], h["min_s"], h["p50_s"], h["p90_s"], h["p99_s"], h["max_s"]] + list(h["buckets_ms"].values()))
+
+    def write_report(self, basename):
+        """
+        Prints the summary, and exports the histograms to basename.json and basename.csv
+        """
+        print("\n" + self.summary())
+        self.export_json(f"{basename}.json")
+        self.export_csv(f"{basename}.csv")
+
+
+metrics = Metrics()  # shared by the whole run
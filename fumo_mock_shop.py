@@ -0,0 +1,437 @@
+"""
+A local stand-in for the shop, used to test and benchmark the whole flow without waiting for a live restock.
+Serves the item info and cart APIs with a scripted cart_type timeline and injected errors, along with minimal login, cart and checkout pages
+that use the same class names and XPaths as FumoCarter.checkout().
+
+Run it on its own with `python fumo_mock_shop.py`, and export the printed variables before starting fumo_carter.py.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+# The mock deliberately doesn't import fumo_constants: the URLs there are read from the environment on import, and the benchmark
+# has to set them after the mock is up. This also lets the mock run without a secrets file. Values match fumo_constants.
+CART_TYPE_CLOSED = 2
+CART_TYPE_SOON = 5
+CART_TYPE_ON_SALE_BACK = 7
+CART_TYPE_ON_SALE_PRE = 8
+CART_TYPE_ON_SALE_NO_PRE = 9
+STATUS_UNAVAILABLE = 400
+STATUS_TROTTLED = 429
+
+# Path served for each of the URLs in fumo_constants.
+MOCK_PATHS = {
+    "USER_INFO_URL": "/mypage/",
+    "CART_PAGE_URL": "/cart/",
+    "CART_CHECKOUT_URL": "/checkoutcart/",
+    "API_GET_ITEM_INFO_URL": "/api/v1.0/item",
+    "API_CART_URL": "/api/v1.0/cart",
+}
+
+# Default timeline: closed, then announced, then the actual restock.
+DEFAULT_SCHEDULE = [(0, CART_TYPE_CLOSED), (5, CART_TYPE_SOON), (10, CART_TYPE_ON_SALE_PRE)]
+PURCHASABLE = (CART_TYPE_ON_SALE_PRE, CART_TYPE_ON_SALE_NO_PRE, CART_TYPE_ON_SALE_BACK)
+
+
+def mock_url_overrides(base_url) -> Dict[str, str]:
+    """
+    :param base_url: Address the mock shop listens on, e.g. http://127.0.0.1:8321
+    :return: The environment variables which point every URL of fumo_constants at the mock shop.
+    """
+    return {f"FUMO_{name}": base_url + path for name, path in MOCK_PATHS.items()}
+
+
+class MockShop:
+    """
+    The state of the mock shop: the cart_type timeline, error injection rates, the cart, and the statistics collected for the benchmarks.
+    """
+
+    def __init__(self, schedule: List[Tuple[float, int]] = None, api_error_rates: Dict[int, float] = None, page_overload_rate=0.0, page_cart_error_rate=0.0, retry_after=None, seed=None):
+        """
+        :param schedule: List of (seconds since start, cart_type), the cart_type applies to every item from that point on.
+        :param api_error_rates: Probability of answering an API call with each status code, e.g. {503: 0.2, 429: 0.05}
+        :param page_overload_rate: Probability of a checkout page showing the "Access Restriction Notice"
+        :param page_cart_error_rate: Probability of a checkout step showing "There was problem."
+        :param retry_after: Value of the Retry-After header sent with 429 responses, if any.
+        :param seed: Seed for the error injection
+        """
+        self.schedule = sorted(schedule or DEFAULT_SCHEDULE)
+        self.api_error_rates = api_error_rates or {}
+        self.page_overload_rate = page_overload_rate
+        self.page_cart_error_rate = page_cart_error_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Restarts the timeline, and clears the cart and the statistics.
+        """
+        with self._lock:
+            self.started_at = time.time()
+            self.cart: Dict[str, int] = {}
+            self.counts: Dict[str, Dict[int, int]] = {}
+            self.first_cart_add_at = None
+            self.order_placed_at = None
+            self.orders = 0
+            self.checkout_step = 0  # furthest checkout step reached since the last order, the checkout page resumes from there.
+
+    def cart_type(self, now=None) -> int:
+        """
+        :return: The cart_type at the given time according to the schedule.
+        """
+        elapsed = (now or time.time()) - self.started_at
+        current = self.schedule[0][1]
+        for at, cart_type in self.schedule:
+            if elapsed >= at:
+                current = cart_type
+        return current
+
+    @property
+    def restocked_at(self) -> Optional[float]:
+        """
+        :return: Epoch time at which items first became purchasable, None if the schedule never gets there.
+        """
+        for at, cart_type in self.schedule:
+            if cart_type in PURCHASABLE:
+                return self.started_at + at
+        return None
+
+    def injected_status(self) -> Optional[int]:
+        """
+        Rolls for an injected API error.
+        :return: The status code to answer with, or None to answer normally.
+        """
+        roll = self._random.random()
+        for code, rate in self.api_error_rates.items():
+            if roll < rate:
+                return code
+            roll -= rate
+        return None
+
+    def roll(self, rate) -> bool:
+        return self._random.random() < rate
+
+    def count(self, endpoint, code):
+        with self._lock:
+            per_code = self.counts.setdefault(endpoint, {})
+            per_code[code] = per_code.get(code, 0) + 1
+
+    def add_to_cart(self, scode, amount):
+        with self._lock:
+            self.cart[scode] = self.cart.get(scode, 0) + amount
+            if self.first_cart_add_at is None:
+                self.first_cart_add_at = time.time()
+
+    def cart_contents(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.cart)
+
+    def place_order(self):
+        with self._lock:
+            self.orders += 1
+            self.cart.clear()
+            self.checkout_step = 0
+            if self.order_placed_at is None:
+                self.order_placed_at = time.time()
+
+    def stats(self) -> dict:
+        """
+        :return: Timings relative to the restock, and the request counts per endpoint and status code.
+        """
+        restocked_at = self.restocked_at
+
+        def since_restock(t):
+            return None if t is None or restocked_at is None else t - restocked_at
+
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "restocked_at": restocked_at,
+                "first_cart_add_s": since_restock(self.first_cart_add_at),
+                "order_placed_s": since_restock(self.order_placed_at),
+                "orders": self.orders,
+                "cart": dict(self.cart),
+                "requests": {endpoint: dict(per_code) for endpoint, per_code in self.counts.items()},
+            }
+
+
+# # Pages. The nesting is what matters here, it mirrors the XPaths used in fumo_carter.
+
+# Every page pulls in an image and a favicon like the real thing does, so that resource blocking has something to block.
+STATIC_ASSET_BYTES = 64 * 1024
+
+
+def page(body, title="Mock shop"):
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title><link rel="icon" href="/static/favicon.ico"></head>'
+            f'<body><div id="__layout">{body}</div><img src="/static/banner.png" alt=""></body></html>')
+
+
+def login_page(action):
+    return page(f'<div><form method="post" action="{action}"><input name="email"><input name="password" type="password">'
+                f'<button class="btn-submit" type="submit">Login</button></form></div>')
+
+
+def overload_page():
+    return page('<div><div class="alert-area"><p class="alert-area__title">Access Restriction Notice</p>'
+                '<p class="alert-area__text">The site is currently very busy, please try again later.</p></div></div>')
+
+
+def cart_error_page():
+    return page(f'<div><h2 class="item-detail__error-title">There was problem.</h2>'
+                f'<a class="btn-back" href="{MOCK_PATHS["CART_CHECKOUT_URL"]}">Back</a></div>')
+
+
+USER_INFO_PAGE = page('<div><div><button class="search-box__button">Search</button></div></div>')
+
+CART_PAGE = page('<div><div><div>header</div><div><div><div><div><section><h2>Shopping cart</h2></section></div></div></div></div></div></div>')
+
+CHECKOUT_STEP_1 = page(f'<div><div><div><div><div>Step 1</div><div><section><h2>Rearrangement options</h2>'
+                       f'<form method="post" action="{MOCK_PATHS["CART_CHECKOUT_URL"]}step2"><button class="btn-submit" type="submit">Next</button></form>'
+                       f'<button type="button">Return</button></section></div></div></div></div></div>')
+
+
+def checkout_step_2():
+    years = "".join(f'<option value="{y}">{y}</option>' for y in range(time.gmtime().tm_year, time.gmtime().tm_year + 12))
+    months = "".join(f'<option value="{m}">{m}</option>' for m in range(1, 13))
+    return page(
+        f'<div><div><div><div><div>Step 2</div><div>'
+        f'<section><h2>Payment & Shipping</h2></section>'
+        f'<section><div><div>Payment method</div><div>'
+        f'<div><label><input class="form-radio" type="radio" name="payment" value="card" form="step2">Credit card</label>'
+        f'<select id="selectCardType" name="card_type" form="step2"><option value="visa">Visa</option><option value="master">Mastercard</option></select></div>'
+        f'<div><div>Card</div><div><input name="card_number" form="step2"></div>'
+        f'<div><div><select name="exp_year" form="step2">{years}</select></div><div><select name="exp_month" form="step2">{months}</select></div></div>'
+        f'<div><input name="card_owner" form="step2"></div><div><input name="security_code" form="step2"></div></div>'
+        f'</div></div></section>'
+        f'<section><div>Shipping method</div><div>'
+        f'<div><span><label><input class="form-radio" type="radio" name="shipping" value="dhl" form="step2">DHL</label></span></div>'
+        f'<div><span><label><input class="form-radio" type="radio" name="shipping" value="surface" form="step2">Surface parcel</label></span></div>'
+        f'</div></section>'
+        f'<form id="step2" method="post" action="{MOCK_PATHS["CART_CHECKOUT_URL"]}step3"><button class="btn-submit" type="submit">Next</button></form>'
+        f'</div></div></div></div></div>')
+
+
+CHECKOUT_STEP_3 = page(f'<div><div><div><div><div>Step 3</div><div><section><div>Order summary</div><div>Total</div>'
+                       f'<div><form method="post" action="{MOCK_PATHS["CART_CHECKOUT_URL"]}order"><button class="btn-submit" type="submit">Place order</button></form></div>'
+                       f'</section></div></div></div></div></div>')
+
+ORDER_COMPLETE = page('<div><div><h2 class="order-complete__title">Thank you for your order</h2></div></div>')
+
+
+class MockShopHandler(BaseHTTPRequestHandler):
+    """
+    Routes the requests to the mock shop of the server.
+    """
+    server_version = "MockShop/1.0"
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real thing
+
+    @property
+    def shop(self) -> MockShop:
+        return self.server.shop
+
+    def log_message(self, format, *args):
+        pass  # way too noisy while polling
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        checkout = MOCK_PATHS["CART_CHECKOUT_URL"]
+        if url.path == MOCK_PATHS["API_GET_ITEM_INFO_URL"]:
+            self.api_item_info(query)
+        elif url.path == MOCK_PATHS["API_CART_URL"]:
+            self.api_cart_get()
+        elif url.path.startswith("/static/"):
+            self.shop.count("static", 200)
+            self.send_body(200, "application/octet-stream", b"\0" * STATIC_ASSET_BYTES)
+        elif url.path == "/__mock__/stats":
+            self.send_json(200, self.shop.stats())
+        elif url.path == MOCK_PATHS["USER_INFO_URL"]:
+            if "mcode" in self.cookies():
+                self.send_page(USER_INFO_PAGE)
+            else:
+                self.send_page(login_page(MOCK_PATHS["USER_INFO_URL"]), cookies={"ransu": f"mock-ransu-{int(time.time())}"})
+        elif url.path == MOCK_PATHS["CART_PAGE_URL"]:
+            self.send_page(CART_PAGE)
+        elif url.path == checkout:
+            self.checkout_page(self.resumed_checkout_page() if "mcode" in self.cookies() else login_page(checkout + "step1"))
+        else:
+            self.send_page(page("<div>Not found</div>"), code=404)
+
+    def do_OPTIONS(self):
+        self.shop.count("options", 204)
+        self.send_body(204, "text/plain", b"", {"Access-Control-Allow-Methods": "GET, POST, OPTIONS"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        checkout = MOCK_PATHS["CART_CHECKOUT_URL"]
+        if url.path == MOCK_PATHS["API_CART_URL"]:
+            self.api_cart_add(json.loads(body or b"{}"))
+        elif url.path == "/__mock__/reset":
+            self.shop.reset()
+            self.send_json(200, {})
+        elif url.path == MOCK_PATHS["USER_INFO_URL"]:
+            self.redirect(MOCK_PATHS["USER_INFO_URL"], cookies={"mcode": "mock-mcode"})
+        elif url.path == checkout + "step1":
+            self.checkout_page(CHECKOUT_STEP_1, cookies={"mcode": "mock-mcode"}, step=1)
+        elif url.path == checkout + "step2":
+            self.checkout_page(checkout_step_2(), step=2)
+        elif url.path == checkout + "step3":
+            form = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+            if "shipping" not in form or "payment" not in form:
+                self.send_page(cart_error_page())
+            else:
+                self.checkout_page(CHECKOUT_STEP_3, step=3)
+        elif url.path == checkout + "order":
+            if self.shop.roll(self.shop.page_overload_rate):
+                self.send_page(overload_page())
+            else:
+                self.shop.place_order()
+                self.send_page(ORDER_COMPLETE)
+        else:
+            self.send_page(page("<div>Not found</div>"), code=404)
+
+    # # API
+
+    def api_item_info(self, query):
+        code = self.shop.injected_status()
+        if code is not None:
+            return self.send_api_error("item", code)
+        cart_type = self.shop.cart_type()
+        etag = f'"{query.get("gcode")}-{cart_type}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.shop.count("item", 304)
+            return self.send_body(304, "application/json", b"", {"ETag": etag})
+        self.shop.count("item", 200)
+        self.send_json(200, {"item": {"gcode": query.get("gcode"), "gname": f"Mock item {query.get('gcode')}", "cart_type": cart_type}}, {"ETag": etag})
+
+    def api_cart_add(self, payload):
+        code = self.shop.injected_status()
+        if code is not None:
+            return self.send_api_error("cart", code)
+        if self.shop.cart_type() not in PURCHASABLE:
+            self.shop.count("cart", STATUS_UNAVAILABLE)
+            return self.send_json(STATUS_UNAVAILABLE, {"error": "not on sale"})
+        self.shop.add_to_cart(payload.get("scode"), payload.get("amount", 1))
+        self.shop.count("cart", 200)
+        self.send_json(200, {"result": "ok"})
+
+    def api_cart_get(self):
+        code = self.shop.injected_status()
+        if code is not None:
+            return self.send_api_error("cart_get", code)
+        self.shop.count("cart_get", 200)
+        self.send_json(200, {"items": [{"scode": scode, "amount": amount} for scode, amount in self.shop.cart_contents().items()]})
+
+    def send_api_error(self, endpoint, code):
+        self.shop.count(endpoint, code)
+        extra = {"Retry-After": str(self.shop.retry_after)} if code == STATUS_TROTTLED and self.shop.retry_after is not None else {}
+        self.send_json(code, {"error": code}, extra)
+
+    # # Pages
+
+    def checkout_page(self, html, cookies=None, step=None):
+        """
+        Serves a checkout page, or one of the injected errors instead.
+        :param step: Checkout step the page belongs to, reaching it is remembered for when the checkout page is loaded again.
+        """
+        if self.shop.roll(self.shop.page_overload_rate):
+            self.send_page(overload_page())
+        elif self.shop.roll(self.shop.page_cart_error_rate):
+            self.send_page(cart_error_page())
+        else:
+            self.shop.count("checkout", 200)
+            if step is not None:
+                self.shop.checkout_step = max(self.shop.checkout_step, step)
+            self.send_page(html, cookies=cookies)
+
+    def resumed_checkout_page(self):
+        """
+        :return: The page of the furthest checkout step reached, a logged in session picks up where it left off.
+        """
+        pages = {0: login_page(MOCK_PATHS["CART_CHECKOUT_URL"] + "step1"), 1: CHECKOUT_STEP_1, 2: checkout_step_2(), 3: CHECKOUT_STEP_3}
+        return pages[self.shop.checkout_step]
+
+    # # Plumbing
+
+    def cookies(self) -> Dict[str, str]:
+        jar = {}
+        for part in (self.headers.get("Cookie") or "").split(";"):
+            if "=" in part:
+                name, value = part.strip().split("=", 1)
+                jar[name] = value
+        return jar
+
+    def send_body(self, code, content_type, body: bytes, extra_headers=None, cookies=None):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        for name, value in (cookies or {}).items():
+            self.send_header("Set-Cookie", f"{name}={value}; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, code, data, extra_headers=None):
+        self.send_body(code, "application/json", json.dumps(data).encode(), extra_headers)
+
+    def send_page(self, html, code=200, cookies=None):
+        self.send_body(code, "text/html; charset=utf-8", html.encode(), cookies=cookies)
+
+    def redirect(self, location, cookies=None):
+        self.send_body(303, "text/html; charset=utf-8", b"", {"Location": location}, cookies)
+
+
+def start_mock_shop(shop: MockShop, host="127.0.0.1", port=0) -> ThreadingHTTPServer:
+    """
+    Starts serving the mock shop from a background thread.
+    :param port: Port to listen on, 0 picks a free one.
+    :return: The running server, its address is in server.server_address
+    """
+    server = ThreadingHTTPServer((host, port), MockShopHandler)
+    server.daemon_threads = True
+    server.shop = shop
+    threading.Thread(target=server.serve_forever, name="mock-shop", daemon=True).start()
+    return server
+
+
+def parse_schedule(text) -> List[Tuple[float, int]]:
+    """
+    Parses a schedule given as "seconds:cart_type,seconds:cart_type", e.g. "0:2,5:5,10:8"
+    """
+    return [(float(at), int(cart_type)) for at, cart_type in (entry.split(":") for entry in text.split(","))]
+
+
+def parse_rates(text) -> Dict[int, float]:
+    """
+    Parses error rates given as "code:rate,code:rate", e.g. "503:0.2,429:0.05"
+    """
+    return {int(code): float(rate) for code, rate in (entry.split(":") for entry in text.split(",") if entry)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for the shop.")
+    parser.add_argument("--port", type=int, default=8321)
+    parser.add_argument("--schedule", type=parse_schedule, default=DEFAULT_SCHEDULE, help='"seconds:cart_type,..." e.g. "0:2,5:5,10:8"')
+    parser.add_argument("--api-errors", type=parse_rates, default={}, help='"code:rate,..." e.g. "503:0.2,429:0.05,400:0.01"')
+    parser.add_argument("--page-overload", type=float, default=0.0)
+    parser.add_argument("--page-cart-error", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=None)
+    args = parser.parse_args()
+
+    mock_server = start_mock_shop(MockShop(args.schedule, args.api_errors, args.page_overload, args.page_cart_error, args.retry_after), port=args.port)
+    for name, value in mock_url_overrides(f"http://127.0.0.1:{mock_server.server_address[1]}").items():
+        print(f"export {name}={value}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock_server.shutdown()
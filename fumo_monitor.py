@@ -0,0 +1,249 @@
+import asyncio
+import concurrent.futures
+import json
+import re
+import threading
+from datetime import datetime
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Iterable
+
+import aiohttp
+
+from fumo_constants import *
+from fumo_governor import RateGovernor
+from fumo_metrics import metrics
+from fumo_tokens import SessionTokens
+
+try:
+    import orjson  # optional, a good deal faster for the documents we can't pick apart
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+_CART_TYPE_RE = re.compile(rb'"cart_type"\s*:\s*(-?\d+)')
+_GNAME_RE = re.compile(rb'"gname"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+def parse_item_info(body: bytes) -> Optional[dict]:
+    """
+    Extracts what the monitor needs from an item info response, without decoding the whole document when possible.
+    Falls back to a full decode if the fields aren't there exactly once, since we can't tell which item they would belong to otherwise.
+    :param body: Raw response body
+    :return: Dict with the cart_type and gname of the item (the whole item with a full decode), None if there is no item in the body.
+    """
+    cart_types = _CART_TYPE_RE.findall(body)
+    gnames = _GNAME_RE.findall(body)
+    if len(cart_types) == 1 and len(gnames) == 1:
+        return {"cart_type": int(cart_types[0]), "gname": json.loads(gnames[0])}
+    return _loads(body).get("item")
+
+
+class ConditionalCache:
+    """
+    Remembers the validators (ETag, Last-Modified) and the parsed body of the last full response for each item,
+    so that the next poll can be a conditional request and an unchanged item doesn't have to be downloaded or decoded again.
+    """
+
+    def __init__(self):
+        self._entries = {}  # key -> (etag, last modified, parsed body)
+
+    def request_headers(self, key) -> dict:
+        """
+        :return: The conditional headers to send for the item, none if we never got a full response for it.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return {}
+        etag, last_modified, _ = entry
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def store(self, key, response_headers, parsed):
+        """
+        Records a full response. Responses without any validator aren't worth remembering.
+        :param response_headers: Case insensitive headers of the response, from requests or aiohttp.
+        """
+        etag, last_modified = response_headers.get("ETag"), response_headers.get("Last-Modified")
+        if etag or last_modified:
+            self._entries[key] = (etag, last_modified, parsed)
+
+    def cached(self, key):
+        """
+        :return: The parsed body of the last full response, to use when the server answers 304.
+        """
+        entry = self._entries.get(key)
+        return entry[2] if entry is not None else None
+
+
+def poll_interval(cart_type) -> float:
+    """
+    :param cart_type: The last cart_type an item reported, None if it didn't answer yet.
+    :return: Minimum time until the item should be polled again.
+    """
+    return POLL_INTERVALS_S.get(cart_type, POLL_INTERVAL_DEFAULT_S)
+
+
+class StockMonitor:
+    """
+    Polls the item info API for every watched item concurrently, and resolves as soon as any of them reaches one of the wanted cart types.
+    Each item is polled at the pace its last cart_type calls for (see POLL_INTERVALS_S), within the overall rate of the governor.
+    """
+
+    def __init__(self, headers, cookies, governor: Optional[RateGovernor] = None, connections_per_host=MONITOR_CONNECTIONS_PER_HOST):
+        """
+        :param headers: Headers sent with every request
+        :param cookies: Dict of cookies for the API session, usually taken from the requests session.
+        :param governor: Rate limit shared with the rest of the API requests, a fresh one by default.
+        :param connections_per_host: Size of the connection pool kept open to each host.
+        """
+        self.headers = headers
+        self.cookies = cookies
+        self.governor = governor or RateGovernor()
+        self.connections_per_host = connections_per_host
+        self.cart_types = {}  # gcode -> last reported cart_type
+        self.conditional = ConditionalCache()
+        self._loop = None  # set while wait_for_cart_type runs, along with the watch state below.
+        self._session = None
+        self._watch = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def wait_for_cart_type(self, items_jsons_check_info: Iterable[dict], tokens: SessionTokens, cart_types=CART_TYPES_PURCHASABLE,
+                                 on_detect: Optional[Callable[[dict, dict, float], None]] = None, stop: Optional[threading.Event] = None) -> Optional[dict]:
+        """
+        Watches all the items until one of them has a matching cart_type.
+        :param items_jsons_check_info: Items as generated by generate_item_jsons_check_info
+        :param tokens: Token store, the current ransu is sent along with each request.
+        :param cart_types: cart_type values which count as in stock
+        :param on_detect: If given, called as on_detect(item, item info, perf_counter() at detection) for every item as soon as it is detected,
+                          from the event loop so it must not block. The other items keep being watched until all of them were detected.
+        :param stop: Event which ends the monitoring early when set, checked every MONITOR_STOP_POLL_S. Interrupts the polling intervals
+                     and the governor's waits.
+        :return: The item info of the first matching item (the last one with on_detect), or None if we stopped because of throttling or stop.
+        """
+        items_jsons_check_info = list(items_jsons_check_info)
+        found = asyncio.get_running_loop().create_future()
+        remaining = {item["gcode"] for item in items_jsons_check_info}
+        connector = aiohttp.TCPConnector(limit_per_host=self.connections_per_host, keepalive_timeout=60)
+        async with aiohttp.ClientSession(connector=connector, headers=self.headers, cookies=self.cookies) as session:
+            watch = dict(found=found, tokens=tokens, cart_types=cart_types, on_detect=on_detect, stop=stop, remaining=remaining)
+            self._loop, self._session, self._watch = asyncio.get_running_loop(), session, watch
+            self._tasks = {item["gcode"]: asyncio.create_task(self._watch_item(session, item=item, **watch)) for item in items_jsons_check_info}
+            stopper = asyncio.create_task(self._watch_stop(stop, found)) if stop is not None else None
+            try:
+                return await found
+            finally:
+                self._loop = self._session = self._watch = None
+                tasks = list(self._tasks.values()) + ([stopper] if stopper is not None else [])
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def update_items(self, add: Iterable[dict] = (), remove: Iterable[str] = ()) -> bool:
+        """
+        Changes the watched items of the running wait_for_cart_type, e.g. after a config reload. Call from any thread but the event loop's.
+        :param add: Items to start watching, as generated by generate_item_jsons_check_info
+        :param remove: gcodes of the items to stop watching.
+        :return: False if the monitor isn't running (anymore), in which case nothing changed.
+        """
+        loop = self._loop
+        if loop is None:
+            return False
+        try:
+            return asyncio.run_coroutine_threadsafe(self._update_items(list(add), list(remove)), loop).result(timeout=1)
+        except (RuntimeError, concurrent.futures.TimeoutError, concurrent.futures.CancelledError):  # the loop closed in the meantime
+            return False
+
+    async def _update_items(self, add: List[dict], remove: List[str]) -> bool:
+        watch = self._watch
+        if watch is None or watch["found"].done():
+            return False
+        for gcode in remove:
+            task = self._tasks.pop(gcode, None)
+            if task is not None:
+                task.cancel()
+            watch["remaining"].discard(gcode)
+        for item in add:
+            if item["gcode"] not in self._tasks:
+                watch["remaining"].add(item["gcode"])
+                self._tasks[item["gcode"]] = asyncio.create_task(self._watch_item(self._session, item=item, **watch))
+        if not watch["remaining"]:  # we only had the removed ones left to wait for
+            watch["found"].set_result(None)
+        return True
+
+    @staticmethod
+    async def _watch_stop(stop: threading.Event, found: asyncio.Future):
+        """
+        Resolves the shared future once stop is set, which cancels the item tasks wherever they're waiting.
+        """
+        while not stop.is_set():
+            await asyncio.sleep(MONITOR_STOP_POLL_S)
+        if not found.done():
+            found.set_result(None)
+
+    async def _watch_item(self, session, found, item, tokens, cart_types, on_detect, stop, remaining):
+        """
+        Polls a single item until the shared future is resolved, by this item or any other, or until it gets handed to on_detect.
+        """
+        gcode = item["gcode"]
+        while not found.done():
+            if stop is not None and stop.is_set():
+                found.set_result(None)
+                break
+            interval = poll_interval(self.cart_types.get(gcode))
+            if interval:
+                await asyncio.sleep(interval)
+            await self.governor.acquire_async()
+            if found.done():
+                break
+            try:
+                start = perf_counter()
+                async with session.get(API_GET_ITEM_INFO_URL, params=tokens.apply(item, ("ransu",)), headers=self.conditional.request_headers(gcode)) as response:
+                    code = response.status
+                    self.governor.on_response(code, response.headers.get("Retry-After"))
+                    tokens.refresh_from_cookies(response.cookies)
+                    print(f"Response was [{code}]")
+                    body = await response.read()
+                    metrics.count("monitor.polls")
+                    metrics.count("monitor.bytes", len(body))
+                    if code == STATUS_SUCCESS:
+                        decode_start = perf_counter()
+                        vals = parse_item_info(body)
+                        metrics.record("monitor.decode", perf_counter() - decode_start)
+                        self.conditional.store(gcode, response.headers, vals)
+                    elif code == STATUS_NOT_MODIFIED:
+                        metrics.count("monitor.not_modified")
+                        vals = self.conditional.cached(gcode)
+                    else:
+                        vals = None
+                metrics.record("monitor.request", perf_counter() - start)
+            except (aiohttp.ClientError, ValueError) as e:  # a single dropped connection or garbled body shouldn't take down the whole monitor
+                print(f"Request for {gcode} failed: {e!r}")
+                continue
+
+            if vals is not None and "cart_type" in vals.keys():
+                detected = vals["cart_type"] in cart_types and not found.done()
+                if detected and on_detect is not None:  # hand it over first, the printing can wait.
+                    on_detect(item, vals, perf_counter())
+                metrics.record(f"monitor.poll.cart_type_{vals['cart_type']}", perf_counter() - start)
+                self.cart_types[gcode] = vals["cart_type"]
+                print(datetime.now().strftime("%H:%M:%S"), end=" - ")
+                print(f"Checked item has cart_type={vals['cart_type']} and is {vals['gname']}")
+
+                if detected:
+                    remaining.discard(gcode)
+                    if on_detect is None or not remaining:
+                        found.set_result(vals)
+                    break
+
+            elif code == STATUS_TROTTLED:
+                if WAIT_FOR_ITEMS_STOP_ON_OVERLOAD:
+                    print("Throttled.. and out.")
+                    if not found.done():
+                        found.set_result(None)
+                    break
+
+                print("Throttled :( the governor will slow us down.")
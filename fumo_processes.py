@@ -0,0 +1,280 @@
+import multiprocessing
+import os
+from multiprocessing.connection import Client, Listener, Connection
+from time import monotonic, sleep, time
+from typing import Callable, Optional
+
+from fumo_constants import *
+from fumo_metrics import metrics
+
+# The stock monitor and the checkout browser, as two processes which can crash and restart independently of each other.
+# The checkout worker owns the browser and listens on CHECKOUT_WORKER_ADDRESS, the monitor connects to it. Messages are dicts:
+#   worker -> monitor: {"type": "session", "cookies", "tokens"}  right after every connection, so the monitor never needs a browser.
+#   monitor -> worker: {"type": "in_stock", "scode", "sent_at"}   an item was detected and went to the cart workers.
+#   monitor -> worker: {"type": "cart_ready", "contents", "sent_at"}   the cart holds something new, check it out.
+#   worker -> monitor: {"type": "checkout_done"}
+#   monitor -> worker: {"type": "done"}   everything was ordered, the worker exits.
+# Whoever connects with the authkey gets the logged in session, so there is no default one.
+
+
+def check_authkey(authkey: bytes) -> bytes:
+    """
+    :return: The key, if it is fit to guard the session.
+    :raises ValueError: if there is no key, or it's the one that used to be the published default.
+    """
+    if not authkey or authkey == b"fumo-checkout":
+        raise ValueError("Set FUMO_CHECKOUT_WORKER_AUTHKEY to the same secret for both processes, or run them with supervise, which makes one up.")
+    return authkey
+
+
+class CheckoutWorker:
+    """
+    Keeps a logged in browser parked on the checkout page, and runs the checkout whenever the monitor says the cart is ready.
+    """
+
+    def __init__(self, address=CHECKOUT_WORKER_ADDRESS, authkey=CHECKOUT_WORKER_AUTHKEY):
+        """
+        :raises ValueError: if the authkey won't do, see check_authkey. Checked before the browser is launched.
+        """
+        from fumo_carter import FumoCarter  # imported here, so that the supervisor doesn't pay for it.
+
+        self.address = address
+        self.authkey = check_authkey(authkey)
+        self.carter = FumoCarter()  # attaches to the browser at BROWSER_DEBUGGER_ADDRESS if there is one, so restarts keep it warm.
+        self.parked_at = 0.0
+
+    def park(self):
+        """
+        Loads the checkout page, so that the browser and its session are warm when the order comes in.
+        """
+        with metrics.timed("ipc.park"):
+            self.carter.driver.get(CART_CHECKOUT_URL)
+        self.parked_at = monotonic()
+
+    def session_message(self) -> dict:
+        """
+        :return: What the monitor needs to talk to the API on its own: the browser's cookies and the session tokens.
+        """
+        self.carter.get_session_tokens()
+        return {"type": "session", "cookies": self.carter.driver.get_cookies(), "tokens": self.carter.tokens.get()}
+
+    def serve(self):
+        """
+        Logs in, then serves one monitor connection at a time, until the monitor says we're done.
+        """
+        self.carter.browser_login()
+        self.park()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"Checkout worker listening on {self.address[0]}:{self.address[1]}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (multiprocessing.AuthenticationError, OSError) as e:
+                    print(f"Refused a connection: {e}")
+                    continue
+                with conn:
+                    if self.handle(conn):
+                        return
+
+    def handle(self, conn: Connection) -> bool:
+        """
+        Handles the messages of a single monitor connection, reparking the browser whenever it's been idle for CHECKOUT_PARK_REFRESH_S.
+        :return: True once the monitor is done, False if it went away.
+        """
+        conn.send(self.session_message())
+        while True:
+            try:
+                if not conn.poll(CHECKOUT_PARK_REFRESH_S):
+                    self.park()
+                    continue
+                message = conn.recv()
+            except (EOFError, OSError):
+                print("The monitor went away, waiting for it to come back.")
+                return False
+            if message["type"] == "in_stock":
+                metrics.record("ipc.in_stock", time() - message["sent_at"])
+                print(f"Monitor detected {message['scode']}")
+                if monotonic() - self.parked_at > CHECKOUT_PARK_REFRESH_S:
+                    self.park()
+            elif message["type"] == "cart_ready":
+                metrics.record("ipc.event_to_checkout", time() - message["sent_at"])
+                print(f"Checking out {message['contents']}")
+                self.carter.checkout()
+                conn.send({"type": "checkout_done"})
+                self.park()
+            elif message["type"] == "done":
+                return True
+
+
+class CheckoutLink:
+    """
+    The monitor's end of the connection to the checkout worker. Reconnects whenever the worker restarts.
+    """
+
+    def __init__(self, on_session: Callable[[dict], None], address=CHECKOUT_WORKER_ADDRESS, authkey=CHECKOUT_WORKER_AUTHKEY):
+        """
+        :param on_session: Called with the session message the worker sends on every connection.
+        :raises ValueError: if the authkey won't do, see check_authkey.
+        """
+        self.on_session = on_session
+        self.address = address
+        self.authkey = check_authkey(authkey)
+        self.conn: Optional[Connection] = None
+
+    @metrics.timed("ipc.connect")
+    def connect(self, timeout_s=CHECKOUT_WORKER_CONNECT_TIMEOUT_S):
+        """
+        Connects to the worker, waiting for it to be up for at most timeout_s.
+        :raises ConnectionError: if it never came up.
+        """
+        self.close()
+        deadline = monotonic() + timeout_s
+        while True:
+            try:
+                self.conn = Client(self.address, authkey=self.authkey)
+                self.on_session(self.conn.recv())
+                return
+            except (EOFError, OSError):
+                self.close()
+                if monotonic() >= deadline:
+                    raise ConnectionError(f"No checkout worker at {self.address[0]}:{self.address[1]}")
+                sleep(0.5)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def in_stock(self, scode):
+        """
+        Lets the worker know an item was detected. Best effort: the monitor never waits on the worker for this.
+        """
+        if self.conn is None:
+            return
+        try:
+            self.conn.send({"type": "in_stock", "scode": scode, "sent_at": time()})
+        except OSError:
+            self.close()
+
+    @metrics.timed("ipc.checkout_round_trip")
+    def check_out(self, contents):
+        """
+        Has the worker check out, and waits until it's done. If the worker dies along the way, the order is sent again once it's back,
+        the checkout resumes from wherever the site puts it.
+        """
+        while True:
+            if self.conn is None:
+                self.connect()
+            try:
+                self.conn.send({"type": "cart_ready", "contents": contents, "sent_at": time()})
+                while self.conn.recv()["type"] != "checkout_done":
+                    pass
+                return
+            except (EOFError, OSError):
+                print("Lost the checkout worker, sending the order again once it's back.")
+                self.close()
+
+    def done(self):
+        """
+        Tells the worker everything was ordered.
+        """
+        try:
+            if self.conn is not None:
+                self.conn.send({"type": "done"})
+        except OSError:
+            pass
+        self.close()
+
+
+def run_checkout_worker(authkey=CHECKOUT_WORKER_AUTHKEY):
+    """
+    Entry point of the checkout worker process.
+    """
+    worker = CheckoutWorker(authkey=authkey)
+    try:
+        worker.serve()
+    finally:
+        metrics.write_report(f"{METRICS_REPORT_BASENAME}_checkout")
+
+
+def run_monitor(authkey=CHECKOUT_WORKER_AUTHKEY):
+    """
+    Entry point of the monitor process: the same flow as fumo_carter.main, with the checkout handed to the worker.
+    The session comes from the worker, so this process never launches a browser.
+    """
+    from fumo_carter import FumoCarter, fill_cart_and_check_out
+    from fumo_config import current_config
+
+    check_authkey(authkey)
+    carter = FumoCarter(lazy_browser=True)
+
+    def on_session(message):
+        carter.tokens.update(**message["tokens"])
+        if carter.session is None:
+            carter.define_requests_session(message["cookies"])
+        else:  # the worker restarted, keep the warm connections and only swap the cookies.
+            for cookie in message["cookies"]:
+                carter.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
+
+    link = CheckoutLink(on_session, authkey=authkey)
+    try:
+        link.connect()
+        if HOT_RELOAD_CONFIG:
+            carter.config_watcher.start()
+        pipelined = WAIT_FOR_ITEMS and PIPELINED_CART
+        if WAIT_FOR_ITEMS and not pipelined:
+            item = carter.wait_for_item_in_stock(list(current_config().item_jsons_check_info))
+            if item is not None:
+                link.in_stock(item.get("gname"))  # the item info doesn't repeat the scode, the name will do for the worker's log
+        fill_cart_and_check_out(carter, link.check_out, pipelined, link.in_stock)
+        link.done()
+    finally:
+        link.close()
+        metrics.write_report(f"{METRICS_REPORT_BASENAME}_monitor")
+
+
+def supervise():
+    """
+    Runs the monitor and the checkout worker, and restarts whichever of them dies. Stops once the monitor finished.
+    The two of them share a key made up for this run only, so that no other local process can get the session out of the worker.
+    """
+    authkey = os.urandom(32)  # not the secrets module, ours shadows it.
+    targets = {"monitor": run_monitor, "checkout": run_checkout_worker}
+    processes = {}
+    for name, target in targets.items():
+        processes[name] = multiprocessing.Process(target=target, args=(authkey,), name=name)
+        processes[name].start()
+    try:
+        while True:
+            sleep(0.5)
+            monitor = processes["monitor"]
+            if not monitor.is_alive() and monitor.exitcode == 0:
+                break
+            for name, process in processes.items():
+                if not process.is_alive() and process.exitcode != 0:  # the worker exits cleanly once the monitor is done with it.
+                    print(f"The {name} process exited with {process.exitcode}, restarting it in {PROCESS_RESTART_DELAY_S}s")
+                    sleep(PROCESS_RESTART_DELAY_S)
+                    processes[name] = multiprocessing.Process(target=targets[name], args=(authkey,), name=name)
+                    processes[name].start()
+    finally:
+        worker = processes["checkout"]
+        worker.join(timeout=10)  # the monitor told it we're done, give it the time to write its report.
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Runs the stock monitor and the checkout browser as separate processes.")
+    parser.add_argument("role", choices=["supervise", "monitor", "checkout"], nargs="?", default="supervise",
+                        help="Both processes under a supervisor which restarts them, or only one of them")
+    args = parser.parse_args()
+    if args.role != "supervise":
+        try:
+            check_authkey(CHECKOUT_WORKER_AUTHKEY)
+        except ValueError as e:
+            parser.error(str(e))
+
+    {"supervise": supervise, "monitor": run_monitor, "checkout": run_checkout_worker}[args.role]()
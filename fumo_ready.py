@@ -0,0 +1,37 @@
+from time import perf_counter, sleep
+from typing import Callable, Optional, TypeVar
+
+from fumo_constants import *
+from fumo_metrics import metrics
+
+T = TypeVar("T")
+
+
+def wait_until(condition: Callable[[], T], name, timeout_s=DOM_WAIT_TIMEOUT_S, poll_s=READY_POLL_S) -> Optional[T]:
+    """
+    Waits for a readiness condition rather than for a fixed amount of time. Timed under ready.<name>.
+    :param condition: Checked right away, then every poll_s, until it returns something truthy.
+    :param name: What we're waiting for, for the report.
+    :return: What the condition returned, None if it never held within timeout_s.
+    """
+    start = perf_counter()
+    deadline = start + timeout_s
+    try:
+        while True:
+            result = condition()
+            if result:
+                return result
+            if perf_counter() >= deadline:
+                print(f"Gave up waiting for {name} after {timeout_s}s")
+                return None
+            sleep(poll_s)
+    finally:
+        metrics.record(f"ready.{name}", perf_counter() - start)
+
+
+def pause(seconds, reason):
+    """
+    A sleep we actually mean, e.g. a backoff. Timed under sleep.<reason>, so that it shows up in the sleep budget of the report.
+    """
+    with metrics.timed(f"sleep.{reason}"):
+        sleep(seconds)
@@ -0,0 +1,144 @@
+import os
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+# Every record is a single line of "epoch_ms,latency_ms,status_code", the status being 0 for a request which got no answer at all
+LOG_HEADER = "epoch_ms,latency_ms,status\n"
+
+
+class RequestLogWriter:
+    """
+    Append-only request log. Records are buffered and flushed in batches, and the file is rotated once it grows past max_bytes,
+    so memory and disk I/O per request stay constant no matter how long we poll for.
+    """
+
+    def __init__(self, path, flush_every=25, max_bytes=10_000_000, backups=5):
+        """
+        :param path: Path of the active log file. Rotated files are path.1 (the newest) up to path.<backups>
+        :param flush_every: Amount of records kept in memory before they get written out.
+        :param max_bytes: Size after which the active file is rotated.
+        :param backups: Amount of rotated files kept around.
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._buffer: List[str] = []
+        self._file = self._open()
+
+    def _open(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path) as f:
+                if f.readline() != LOG_HEADER:  # left over from the old pandas format, move it out of the way
+                    os.replace(self.path, f"{self.path}.old")
+        f = open(self.path, "a", newline="")
+        if f.tell() == 0:
+            f.write(LOG_HEADER)
+        return f
+
+    def write(self, epoch_s, latency_s, status):
+        """
+        Adds a record to the log.
+        :param epoch_s: Time the request was sent, as returned by time.time()
+        :param latency_s: Time until the response, in seconds.
+        :param status: HTTP status code
+        """
+        self._buffer.append(f"{int(epoch_s * 1000)},{int(latency_s * 1000)},{status}\n")
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write("".join(self._buffer))
+            self._buffer.clear()
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self._file = self._open()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def log_files(path) -> List[str]:
+    """
+    :return: The active log file and all of its rotations, oldest first.
+    """
+    rotated = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        rotated.append(f"{path}.{i}")
+        i += 1
+    return rotated[::-1] + ([path] if os.path.exists(path) else [])
+
+
+def read_records(paths: Iterable[str]) -> Iterator[Tuple[int, int, int]]:
+    """
+    Streams the records of the given log files, one line at a time.
+    :return: Iterator over (epoch_ms, latency_ms, status)
+    """
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line == LOG_HEADER or not line.strip():
+                    continue
+                epoch_ms, latency_ms, status = line.split(",")
+                yield int(epoch_ms), int(latency_ms), int(status)
+
+
+def aggregate(records: Iterable[Tuple[int, int, int]], window_s=60) -> Iterator[Dict]:
+    """
+    Aggregates records into fixed time windows, only ever holding a single window in memory.
+    Records are expected in time order, which is how they are written.
+    :return: Iterator over one dict per window, with the request count, the share of each status code and the mean latency.
+             success_rate counts the 304s of conditional requests too, they're a 200 whose body we already had.
+    """
+    window_ms = int(window_s * 1000)
+    current = None
+    counts: Dict[int, int] = {}
+    total = latency_sum = 0
+
+    def summary():
+        return {"window_start_ms": current * window_ms, "requests": total, "mean_latency_ms": latency_sum / total,
+                "success_rate": (counts.get(200, 0) + counts.get(304, 0)) / total, "throttled_rate": counts.get(429, 0) / total, "overloaded_rate": counts.get(503, 0) / total,
+                "status_counts": dict(counts)}
+
+    for epoch_ms, latency_ms, status in records:
+        window = epoch_ms // window_ms
+        if window != current:
+            if total:
+                yield summary()
+            current, counts, total, latency_sum = window, {}, 0, 0
+        counts[status] = counts.get(status, 0) + 1
+        total += 1
+        latency_sum += latency_ms
+    if total:
+        yield summary()
+
+
+if __name__ == '__main__':
+    import argparse
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description="Summarizes request logs per time window.")
+    parser.add_argument("path", help="Active log file, its rotations are read as well")
+    parser.add_argument("--window", type=float, default=60, help="Window size in seconds")
+    args = parser.parse_args()
+
+    print(f"{'window':<10}{'requests':>9}{'200/304':>8}{'429':>8}{'503':>8}{'latency':>10}")
+    for w in aggregate(read_records(log_files(args.path)), args.window):
+        start = datetime.fromtimestamp(w["window_start_ms"] / 1000).strftime("%H:%M:%S")
+        print(f"{start:<10}{w['requests']:>9}{w['success_rate']:>8.1%}{w['throttled_rate']:>8.1%}{w['overloaded_rate']:>8.1%}{w['mean_latency_ms']:>8.0f}ms")
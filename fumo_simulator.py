@@ -0,0 +1,363 @@
+import heapq
+import itertools
+import random
+from collections import Counter, deque
+from statistics import mean
+from typing import Dict, Iterable, List, Tuple
+
+from fumo_constants import *
+from fumo_governor import RateGovernor
+from fumo_monitor import poll_interval
+from fumo_request_log import aggregate
+
+# The parameters a simulation can be run with, and their live values. Sweep any of them with --grid.
+DEFAULT_PARAMS = {
+    "loop_wait_ms": LOOP_WAIT_TIME_MS,  # sets the governor's starting rate, as it does live
+    "requestor_wait_ms": REQUESTOR_WAIT_MS,
+    "wait_after_success_s": WAIT_TIME_AFTER_SUCCESS,
+    "rate_decrease": API_RATE_DECREASE,
+    "rate_increase": API_RATE_INCREASE,
+    "retry_after_s": None,  # the logs don't have it, set it to see what honoring a Retry-After on every 429 and 503 would do.
+    "pipelined": PIPELINED_CART,
+    "stop_on_overload": WAIT_FOR_ITEMS_STOP_ON_OVERLOAD,
+    "order_all_at_once": ORDER_ALL_AT_ONCE,
+    "checkout_s": 0.0,  # time the browser checkout takes between two rounds of cart adds
+}
+THROTTLED_STATUSES = (STATUS_TROTTLED, STATUS_TOO_MUCH_TRAFFIC)
+
+
+class ServerModel:
+    """
+    Response model of the API, fitted from request logs: for each time window, the share of every status code, the mean latency,
+    and the request rate they were observed under.
+    The odds of being throttled grow with how much harder the simulated client hits the server than the logging client did in that window,
+    the rest of the mix is taken as is.
+    """
+
+    def __init__(self, windows: List[Dict], window_s):
+        """
+        :param windows: One dict per window, with its "rate" (requests/s), status "mix" (status -> share) and "latency_s"
+        :param window_s: Duration of each window. The simulation goes through them in order, and starts over past the last one.
+        """
+        self.windows = windows
+        self.window_s = window_s
+
+    @classmethod
+    def fit(cls, records: Iterable[Tuple[int, int, int]], window_s=10) -> "ServerModel":
+        """
+        :param records: (epoch_ms, latency_ms, status) records, as returned by fumo_request_log.read_records
+        :param window_s: Resolution of the model. Windows without any record are left out, so gaps in the logs are skipped over.
+        """
+        windows = []
+        for w in aggregate(records, window_s):
+            counts = Counter(w["status_counts"])
+            counts[STATUS_SUCCESS] += counts.pop(STATUS_NOT_MODIFIED, 0)  # a 304 is a 200 we had already seen
+            windows.append({"rate": w["requests"] / window_s, "latency_s": w["mean_latency_ms"] / 1000,
+                            "mix": {status: count / w["requests"] for status, count in counts.items()}})
+        if not windows:
+            raise ValueError("No records to fit the model on")
+        return cls(windows, window_s)
+
+    def throttle_windows(self, threshold=0.5) -> List[Tuple[float, float]]:
+        """
+        :param threshold: Share of 429 and 503 from which a window counts as throttled.
+        :return: (start_s, end_s) of every stretch of consecutive throttled windows.
+        """
+        spans = []
+        for i, w in enumerate(self.windows):
+            if sum(w["mix"].get(status, 0) for status in THROTTLED_STATUSES) < threshold:
+                continue
+            if spans and spans[-1][1] == i * self.window_s:
+                spans[-1] = (spans[-1][0], (i + 1) * self.window_s)
+            else:
+                spans.append((i * self.window_s, (i + 1) * self.window_s))
+        return spans
+
+    def respond(self, t, client_rate, rng: random.Random) -> Tuple[int, float]:
+        """
+        :param t: Time the request is sent, in seconds from the start of the simulation.
+        :param client_rate: Requests the simulated client sent over the last second.
+        :return: (status, latency_s)
+        """
+        w = self.windows[int(t // self.window_s) % len(self.windows)]
+        mix = w["mix"]
+        throttled = sum(mix.get(status, 0) for status in THROTTLED_STATUSES)
+        if throttled and rng.random() < min(1.0, throttled * max(1.0, client_rate / w["rate"])):
+            status = STATUS_TROTTLED if rng.random() < mix.get(STATUS_TROTTLED, 0) / throttled else STATUS_TOO_MUCH_TRAFFIC
+        else:
+            others = {status: share for status, share in mix.items() if status not in THROTTLED_STATUSES}
+            status = rng.choices(list(others), weights=list(others.values()))[0] if others else STATUS_SUCCESS
+        return status, w["latency_s"] * rng.uniform(0.5, 1.5)
+
+
+class Simulation:
+    """
+    Discrete-event replay of the ordering flow of fumo_carter against a ServerModel: the stock monitor, the cart workers and the
+    reconciliation rounds, all sharing a RateGovernor which runs on the simulated clock. No time is actually waited.
+    The items go from "soon" to on sale at restock_at_s, answers before then are "not yet".
+    """
+
+    def __init__(self, model: ServerModel, params=None, items=3, restock_at_s=60.0, horizon_s=600.0, seed=None):
+        """
+        :param params: Overrides of DEFAULT_PARAMS
+        :param items: Amount of watched items.
+        :param restock_at_s: Time of the restock, in seconds from the start.
+        :param horizon_s: The simulation gives up past this time.
+        """
+        self.model = model
+        self.params = {**DEFAULT_PARAMS, **(params or {})}
+        self.items = [f"item_{i}" for i in range(items)]
+        self.restock_at_s = restock_at_s
+        self.horizon_s = horizon_s
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.finished = False
+        self._queue = []
+        self._seq = itertools.count()
+        self._recent = deque()  # send times of the last second
+        rate = 1000 / self.params["loop_wait_ms"]
+        self.governor = RateGovernor(rate, API_BURST, API_RATE_MIN_PER_SECOND, rate * API_RATE_MAX_PER_SECOND / API_RATE_PER_SECOND, self.params["rate_decrease"], self.params["rate_increase"],
+                                     clock=lambda: self.now, verbose=False)
+        self.statuses = Counter()
+        self.detected_at: Dict[str, float] = {}
+        self.carted_at: Dict[str, float] = {}
+        self.rounds = 0
+
+    def spawn(self, process, delay=0.0):
+        """
+        Schedules a process, a generator which yields the amount of time it waits each time it waits.
+        """
+        heapq.heappush(self._queue, (self.now + delay, next(self._seq), process))
+
+    def run(self) -> Dict:
+        """
+        Runs until everything was carted or until the horizon.
+        :return: See result.
+        """
+        self.spawn(self._order())
+        while self._queue and not self.finished:
+            at, _, process = heapq.heappop(self._queue)
+            if at > self.horizon_s:
+                break
+            self.now = at
+            try:
+                delay = next(process)
+            except StopIteration:
+                continue
+            self.spawn(process, delay)
+        return self.result()
+
+    def result(self) -> Dict:
+        """
+        :return: Mean time from the restock to the detection and to the cart add of each item, the time until the last item was carted
+        (None if some never were), and the request volume.
+        """
+        detection = [at - self.restock_at_s for at in self.detected_at.values()]
+        cart = [at - self.restock_at_s for at in self.carted_at.values()]
+        requests = sum(self.statuses.values())
+        return {"detection_s": mean(detection) if detection else None,
+                "cart_s": mean(cart) if cart else None,
+                "all_carted_s": max(cart) if len(cart) == len(self.items) else None,
+                "carted": len(cart),
+                "requests": requests,
+                "throttled": sum(self.statuses[status] for status in THROTTLED_STATUSES),
+                "requests_per_s": requests / self.now if self.now else 0.0,
+                "rounds": self.rounds}
+
+    def _request(self, cancelled=None):
+        """
+        Sends a request through the governor, like the live code does.
+        :param cancelled: Checked after waiting on the governor, as with RateGovernor.acquire
+        :return: (status, sent_at), None if cancelled.
+        """
+        delay = self.governor.reserve()
+        if delay > 0:
+            yield delay
+            if cancelled is not None and cancelled():
+                return None
+        sent_at = self.now
+        while self._recent and self._recent[0] <= sent_at - 1:
+            self._recent.popleft()
+        self._recent.append(sent_at)
+        status, latency = self.model.respond(sent_at, len(self._recent), self.rng)
+        self.statuses[status] += 1
+        yield latency
+        self.governor.on_response(status, self.params["retry_after_s"] if status in THROTTLED_STATUSES else None)
+        return status, sent_at
+
+    def _in_stock(self, t) -> bool:
+        return t >= self.restock_at_s
+
+    def _watch(self, item, batch):
+        """
+        StockMonitor._watch_item
+        """
+        cart_type = None
+        while not batch["monitor_done"]:
+            if batch["cancelled"]:
+                batch["monitor_done"] = True
+                break
+            interval = poll_interval(cart_type)
+            if interval:
+                yield interval
+            status, sent_at = yield from self._request()
+            if batch["monitor_done"]:
+                break
+            if status == STATUS_SUCCESS:
+                cart_type = CART_TYPE_ON_SALE_PRE if self._in_stock(sent_at) else CART_TYPE_SOON
+                if cart_type in CART_TYPES_PURCHASABLE:
+                    self.detected_at.setdefault(item, self.now)
+                    batch["remaining"].discard(item)
+                    if self.params["pipelined"]:
+                        self._submit(batch, item)
+                    if not self.params["pipelined"] or not batch["remaining"]:
+                        batch["monitor_done"] = True
+                    break
+            elif status == STATUS_TROTTLED and self.params["stop_on_overload"]:
+                batch["monitor_done"] = True
+                break
+
+    def _submit(self, batch, item):
+        batch["jobs"] += 1
+        self.spawn(self._add_item(batch, item))
+
+    def _add_item(self, batch, item):
+        """
+        CartEngine._worker and _add_item
+        """
+        while not batch["cancelled"]:
+            response = yield from self._request(lambda: batch["cancelled"])
+            if response is None:
+                break
+            status, sent_at = response
+            if status == STATUS_SUCCESS and self._in_stock(sent_at):
+                self.carted_at.setdefault(item, self.now)
+                if not self.params["order_all_at_once"]:
+                    yield from self._confirm(batch)
+                    batch["cancelled"] = True
+                break
+            yield self.params["requestor_wait_ms"] / 1000
+        batch["jobs"] -= 1
+
+    def _confirm(self, batch):
+        """
+        The wait for the cart API to show the item, before the rest of the batch gets cancelled.
+        """
+        deadline = self.now + self.params["wait_after_success_s"]
+        for read in range(CART_CONFIRM_READS):
+            if read:
+                yield max(CART_CONFIRM_POLL_S, 1 / self.governor.rate)
+            if batch["cancelled"] or self.now >= deadline:
+                return
+            status, _ = yield from self._request()
+            if status == STATUS_SUCCESS:
+                return
+        if not batch["cancelled"] and self.now < deadline:
+            yield deadline - self.now
+
+    def _order(self):
+        """
+        The reconciliation loop of fumo_carter.fill_cart_and_check_out
+        """
+        missing = list(self.items)
+        pipelined = self.params["pipelined"]
+        if not pipelined:  # wait_for_item_in_stock, once, before the first round.
+            batch = {"cancelled": False, "jobs": 0, "monitor_done": False, "remaining": set(missing)}
+            for item in missing:
+                self.spawn(self._watch(item, batch))
+            while not batch["monitor_done"]:
+                yield READY_POLL_S
+        while missing:
+            self.rounds += 1
+            batch = {"cancelled": False, "jobs": 0, "monitor_done": not pipelined, "remaining": set(missing)}
+            if pipelined:
+                for item in missing:
+                    self.spawn(self._watch(item, batch))
+                while not batch["monitor_done"]:
+                    yield READY_POLL_S
+                for item in batch["remaining"]:  # never detected, attempted anyway
+                    self._submit(batch, item)
+            else:
+                for item in missing:
+                    self._submit(batch, item)
+            while batch["jobs"]:
+                yield READY_POLL_S
+            carted = [item for item in missing if item in self.carted_at]
+            missing = [item for item in missing if item not in self.carted_at]
+            if carted:
+                yield self.params["checkout_s"]
+        self.finished = True
+
+
+def sweep(model: ServerModel, grid: Dict[str, list], runs=20, **simulation_args) -> List[Tuple[Dict, Dict]]:
+    """
+    Simulates every combination of the grid's parameters.
+    :param grid: Parameter name -> values to try, any of DEFAULT_PARAMS.
+    :param runs: Simulations per combination, with different seeds. The results are averaged over them.
+    :param simulation_args: Passed on to Simulation.
+    :return: (params, averaged result) of each combination.
+    """
+    names = list(grid)
+    results = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = dict(zip(names, values))
+        runs_results = [Simulation(model, params, seed=seed, **simulation_args).run() for seed in range(runs)]
+        averaged = {}
+        for key in runs_results[0]:
+            values_of_key = [r[key] for r in runs_results if r[key] is not None]
+            averaged[key] = mean(values_of_key) if values_of_key else None
+        averaged["all_carted_rate"] = sum(r["all_carted_s"] is not None for r in runs_results) / runs
+        results.append((params, averaged))
+    return results
+
+
+def parse_grid_value(value: str):
+    """
+    :return: The value of a --grid entry, as a number, a boolean or None.
+    """
+    constants = {"true": True, "false": False, "none": None}
+    if value.lower() in constants:
+        return constants[value.lower()]
+    return float(value)
+
+
+if __name__ == '__main__':
+    import argparse
+    from time import perf_counter
+
+    from fumo_request_log import log_files, read_records
+
+    def parse_grid(text) -> Tuple[str, List]:
+        name, values = text.split("=", 1)
+        if name not in DEFAULT_PARAMS:
+            raise argparse.ArgumentTypeError(f"unknown parameter {name}, expected one of {', '.join(DEFAULT_PARAMS)}")
+        return name, [parse_grid_value(value) for value in values.split(",")]
+
+    parser = argparse.ArgumentParser(description="Replays the polling and cart strategies against a server model fitted from request logs.")
+    parser.add_argument("path", nargs="?", default=REQUEST_LOG_PATH, help="Active log file, its rotations are read as well")
+    parser.add_argument("--window", type=float, default=10, help="Resolution of the server model, in seconds")
+    parser.add_argument("--grid", type=parse_grid, action="append", default=[], help='e.g. "loop_wait_ms=100,250,500", can be repeated')
+    parser.add_argument("--runs", type=int, default=20, help="Simulations per combination")
+    parser.add_argument("--items", type=int, default=3, help="Amount of watched items")
+    parser.add_argument("--restock-at", type=float, default=60, help="Seconds from the start of the simulation until the restock")
+    parser.add_argument("--horizon", type=float, default=600, help="Seconds after which a simulation gives up")
+    args = parser.parse_args()
+
+    model = ServerModel.fit(read_records(log_files(args.path)), args.window)
+    print(f"Fitted {len(model.windows)} windows of {args.window:g}s, throttled: "
+          + (", ".join(f"{start:g}-{end:g}s" for start, end in model.throttle_windows()) or "never"))
+
+    grid = dict(args.grid) or {"loop_wait_ms": [LOOP_WAIT_TIME_MS]}
+    start = perf_counter()
+    results = sweep(model, grid, args.runs, items=args.items, restock_at_s=args.restock_at, horizon_s=args.horizon)
+    print(f"{len(results) * args.runs} simulations in {perf_counter() - start:.1f}s\n")
+
+    def fmt(value):
+        return f"{value:>8.2f}s" if value is not None else f"{'-':>9}"
+
+    names = list(grid)
+    print("".join(f"{name:>22}" for name in names) + f"{'detect':>9}{'cart':>9}{'all':>9}{'all %':>7}{'requests':>10}{'req/s':>8}{'throttled':>10}")
+    for params, r in sorted(results, key=lambda pr: (-pr[1]["all_carted_rate"], pr[1]["cart_s"] if pr[1]["cart_s"] is not None else float("inf"))):
+        print("".join(f"{str(params[name]):>22}" for name in names)
+              + f"{fmt(r['detection_s'])}{fmt(r['cart_s'])}{fmt(r['all_carted_s'])}{r['all_carted_rate']:>7.0%}"
+              + f"{r['requests']:>10.0f}{r['requests_per_s']:>8.1f}{r['throttled']:>10.0f}")
@@ -0,0 +1,51 @@
+import json
+import os
+from time import time
+from typing import List, Optional
+
+import requests
+
+
+def session_cookies(session: requests.Session) -> List[dict]:
+    """
+    :return: The cookies of the session, in the same format as driver.get_cookies() (plus the expiry, when there is one).
+    """
+    return [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path, "expiry": c.expires} for c in session.cookies]
+
+
+def save_session_snapshot(path, session: requests.Session, tokens: dict):
+    """
+    Writes what the API needs from the login to a local file: cookies and session tokens. The headers aren't part of it, they come from
+    fumo_data.json on every run, same as without a snapshot.
+    The file is only readable by the current user, since it's as good as being logged in.
+    :param tokens: The ransu and mcode
+    """
+    snapshot = {"saved_at": time(), "tokens": tokens, "cookies": session_cookies(session)}
+    fd = os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(f"{path}.tmp", path)  # never leave a half written snapshot behind
+
+
+def load_session_snapshot(path, max_age_s) -> Optional[dict]:
+    """
+    Loads a snapshot written by save_session_snapshot, as long as it's still usable.
+    :param max_age_s: Snapshots older than this are considered expired.
+    :return: The snapshot, or None if there is none, it is too old, the tokens are missing or any of its cookies expired.
+    """
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    now = time()
+    if now - snapshot["saved_at"] > max_age_s:
+        print("Session snapshot is too old, ignoring it.")
+        return None
+    if not snapshot["tokens"].get("ransu") or not snapshot["tokens"].get("mcode"):
+        print("Session snapshot has no tokens, ignoring it.")
+        return None
+    if any(cookie.get("expiry") and cookie["expiry"] < now for cookie in snapshot["cookies"]):
+        print("Session snapshot has expired cookies, ignoring it.")
+        return None
+    return snapshot
@@ -0,0 +1,67 @@
+import threading
+from typing import Dict, Optional
+
+TOKEN_NAMES = ("ransu", "mcode")
+
+
+class SessionTokens:
+    """
+    Holds the ransu and mcode session tokens, which request payloads read at send time rather than having them baked in.
+    Reads never block: every update swaps in a new dict, and readers only ever see a complete one.
+    """
+
+    def __init__(self, ransu=None, mcode=None):
+        self._tokens: Dict[str, Optional[str]] = {"ransu": ransu, "mcode": mcode}
+        self._lock = threading.Lock()  # only for writers, so that two concurrent updates don't lose one of the tokens.
+
+    @property
+    def ransu(self) -> Optional[str]:
+        return self._tokens["ransu"]
+
+    @property
+    def mcode(self) -> Optional[str]:
+        return self._tokens["mcode"]
+
+    def get(self) -> Dict[str, Optional[str]]:
+        """
+        :return: The current tokens. The dict must not be modified.
+        """
+        return self._tokens
+
+    def update(self, **tokens) -> bool:
+        """
+        Replaces the given tokens, leaving the others as they are. None values are ignored.
+        :return: Whether anything changed.
+        """
+        with self._lock:
+            new = {**self._tokens, **{name: value for name, value in tokens.items() if name in TOKEN_NAMES and value is not None}}
+            if new == self._tokens:
+                return False
+            self._tokens = new
+        print(f"Session tokens updated: {', '.join(name for name in tokens if tokens[name] is not None)}")
+        return True
+
+    def refresh_from_cookies(self, cookies) -> bool:
+        """
+        Picks up the tokens from a cookie jar, or from a single response's cookies.
+        :param cookies: Anything with a dict-like get(name), e.g. a requests cookie jar or response.cookies
+        :return: Whether anything changed.
+        """
+        found = {}
+        for name in TOKEN_NAMES:
+            try:
+                value = cookies.get(name)
+            except RuntimeError:  # requests' CookieConflictError, the name is set for several domains. the full jar refresh handles that.
+                continue
+            if value is not None:
+                found[name] = getattr(value, "value", value)  # aiohttp and http.cookies hand out Morsels rather than strings
+        return self.update(**found)
+
+    def apply(self, payload: dict, names=TOKEN_NAMES) -> dict:
+        """
+        :param payload: Request payload or query parameters
+        :param names: Which of the tokens to add
+        :return: A copy of the payload with the current tokens.
+        """
+        tokens = self._tokens
+        return {**payload, **{name: tokens[name] for name in names}}
@@ -0,0 +1,108 @@
+import threading
+from time import perf_counter
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from fumo_constants import *
+from fumo_governor import RateGovernor
+from fumo_metrics import metrics
+
+
+def build_api_session(pool_size=CART_WORKERS) -> requests.Session:
+    """
+    Creates a requests session whose connection pool is large enough for every cart worker to get a connection of its own.
+    :param pool_size: Amount of connections kept per host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class ConnectionWarmer:
+    """
+    Opens the connections to the API ahead of time, and keeps them alive until they are needed.
+    That way neither the first poll nor the first cart request pays for DNS, TCP and TLS setup.
+    Every request goes through the governor like any other API request, and no keep-alive round is sent while a Retry-After holds.
+    """
+
+    def __init__(self, session: requests.Session, url=API_CART_URL, connections=CART_WORKERS, interval_s=KEEPALIVE_INTERVAL_S,
+                 governor: Optional[RateGovernor] = None):
+        """
+        :param session: Session whose pool should be warmed, it should have been built with build_api_session.
+        :param url: Any URL on the API host. Only cheap OPTIONS requests are sent to it.
+        :param connections: Amount of connections to open and keep alive.
+        :param interval_s: Time between keep-alive rounds, well below the server's idle timeout.
+        :param governor: Rate limit shared with the rest of the API requests, a fresh one by default.
+        """
+        self.session = session
+        self.url = url
+        self.connections = connections
+        self.interval_s = interval_s
+        self.governor = governor or RateGovernor()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _touch_all(self) -> List[float]:
+        """
+        Sends one request per connection, each in the slot the governor gives it. When the budget is idle, the slots are all at once and each
+        request goes over a different pooled connection. When it isn't, they are spread out, and some of them share a connection instead.
+        :return: The duration of each request.
+        """
+        durations = []
+        lock = threading.Lock()
+
+        def touch(delay):
+            if delay > 0 and self._stop.wait(delay):
+                return
+            start = perf_counter()
+            try:
+                self.session.request("OPTIONS", self.url, timeout=API_REQUEST_TIMEOUT_S)
+            except requests.RequestException as e:
+                print(f"Keep-alive request failed: {e!r}")
+                return
+            with lock:
+                durations.append(perf_counter() - start)
+
+        # the slots are all taken right away, so that the polls and cart requests are paced around the whole round.
+        threads = [threading.Thread(target=touch, args=(self.governor.reserve(),), daemon=True) for _ in range(self.connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return durations
+
+    def warm_up(self) -> Dict[str, float]:
+        """
+        Opens all the connections, then goes over them once more to compare the cold and warm cost.
+        :return: Mean duration of a request on a cold and on a warm connection.
+        """
+        cold = self._touch_all()
+        warm = self._touch_all()
+        for duration in cold:
+            metrics.record("warmup.cold_request", duration)
+        for duration in warm:
+            metrics.record("warmup.warm_request", duration)
+        report = {"cold_s": sum(cold) / len(cold) if cold else 0.0, "warm_s": sum(warm) / len(warm) if warm else 0.0}
+        print(f"Warmed {len(cold)} connections. cold request: {report['cold_s'] * 1000:.0f}ms, warm request: {report['warm_s'] * 1000:.0f}ms")
+        return report
+
+    def start(self):
+        """
+        Keeps the connections alive from a background thread until stop() is called.
+        """
+        self._thread = threading.Thread(target=self._keepalive, name="keepalive", daemon=True)
+        self._thread.start()
+
+    def _keepalive(self):
+        while not self._stop.wait(self.interval_s):
+            if self.governor.hold_remaining() > 0:  # the server asked for a break, the connections will have to fend for themselves.
+                metrics.count("keepalive.skipped")
+                continue
+            self._touch_all()
+
+    def stop(self):
+        self._stop.set()